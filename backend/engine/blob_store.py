@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from engine.security import sign_blob_id
+
+BLOB_KEY = "$blob"
+
+_BLOB_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_TEXT = "text/plain; charset=utf-8"
+_JSON = "application/json"
+_SUFFIX = {_TEXT: ".txt", _JSON: ".json"}
+
+_DEFAULT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "blobs")
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, Mapping) and BLOB_KEY in value
+
+
+def _exceeds(value: Any, limit: int) -> bool:
+    return estimate_size(value, limit) > limit
+
+
+def estimate_size(value: Any, limit: Optional[int] = None) -> int:
+    """Cheap size estimate of a JSON-like value; stops as soon as it passes limit."""
+    total = 0
+    stack = [value]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, str):
+            total += len(cur)
+        elif isinstance(cur, Mapping):
+            total += len(cur)
+            for k, v in cur.items():
+                total += len(str(k))
+                stack.append(v)
+        elif isinstance(cur, (list, tuple)):
+            total += len(cur)
+            stack.extend(cur)
+        else:
+            total += 8
+        if limit is not None and total > limit:
+            break
+    return total
+
+
+class BlobStore:
+    """Content-addressed local disk store for large values.
+
+    Values above ``threshold`` bytes are written once under their SHA-256 and
+    replaced by a small reference ``{"$blob": id, "size", "content_type",
+    "url"}``. References are JSON-serializable, so they travel through state,
+    logs and API responses; templates load them on access. The URL carries a
+    signature, so only holders of a reference can download the blob.
+
+    Decoded text is kept in an LRU bounded by ``cache_bytes`` (measured in
+    memory, not on disk); blobs are immutable, so repeated template access
+    does not re-read the file. JSON is parsed per access, so every caller
+    gets its own objects.
+    Blobs untouched for ``ttl_seconds`` are purged in the background at most
+    every ``purge_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        threshold: int,
+        ttl_seconds: int = 86400,
+        purge_interval: int = 3600,
+        cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.directory = os.path.abspath(directory)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + purge_interval
+        self._purging = False
+
+    @classmethod
+    def from_env(cls) -> "BlobStore":
+        return cls(
+            directory=os.getenv("BLOB_DIR") or _DEFAULT_DIR,
+            threshold=int(os.getenv("BLOB_THRESHOLD_BYTES", "262144")),
+            ttl_seconds=int(os.getenv("BLOB_TTL_SECONDS", "86400")),
+            purge_interval=int(os.getenv("BLOB_PURGE_INTERVAL_SECONDS", "3600")),
+            cache_bytes=int(os.getenv("BLOB_CACHE_BYTES", str(64 * 1024 * 1024))),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def path_for(self, blob_id: str) -> Optional[str]:
+        """Return the file path of a stored blob, or None if unknown."""
+        if not _BLOB_ID_RE.match(blob_id):
+            return None
+        for suffix in _SUFFIX.values():
+            path = os.path.join(self.directory, blob_id[:2], blob_id + suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, value: Any) -> Dict[str, Any]:
+        if isinstance(value, str):
+            data, content_type = value.encode("utf-8"), _TEXT
+        else:
+            data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+            content_type = _JSON
+        blob_id = hashlib.sha256(data).hexdigest()
+        folder = os.path.join(self.directory, blob_id[:2])
+        path = os.path.join(folder, blob_id + _SUFFIX[content_type])
+        if not os.path.exists(path):
+            os.makedirs(folder, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        else:
+            os.utime(path)  # keep re-referenced blobs from being purged
+        self._maybe_purge()
+        return {
+            BLOB_KEY: blob_id,
+            "size": len(data),
+            "content_type": content_type,
+            "url": f"/blobs/{blob_id}?sig={sign_blob_id(blob_id)}",
+        }
+
+    def load(self, ref: Mapping) -> Any:
+        """Read a referenced value back (memory-mapped, text decoded once)."""
+        blob_id = str(ref.get(BLOB_KEY))
+        path = self.path_for(blob_id)
+        if path is None:
+            return None
+        text = self._text(blob_id, path)
+        return json.loads(text) if path.endswith(_SUFFIX[_JSON]) else text
+
+    def _text(self, blob_id: str, path: str) -> str:
+        with self._lock:
+            hit = self._cache.get(blob_id)
+            if hit is not None:
+                self._cache.move_to_end(blob_id)
+                return hit[1]
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                text = ""
+            else:
+                # Decode straight from the mapping, without a bytes copy
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    text = codecs.utf_8_decode(mm, "strict", True)[0]
+        self._remember(blob_id, text)
+        return text
+
+    def _remember(self, blob_id: str, text: str) -> None:
+        size = sys.getsizeof(text)
+        if size > self.cache_bytes:
+            return
+        with self._lock:
+            if blob_id in self._cache:
+                return
+            self._cache[blob_id] = (size, text)
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_bytes:
+                _, (old_size, _) = self._cache.popitem(last=False)
+                self._cached_bytes -= old_size
+
+    def _maybe_purge(self) -> None:
+        """Start a background purge when the interval has elapsed."""
+        if self.purge_interval <= 0 or time.monotonic() < self._next_purge:
+            return
+        with self._lock:
+            if self._purging or time.monotonic() < self._next_purge:
+                return
+            self._purging = True
+            self._next_purge = time.monotonic() + self.purge_interval
+        threading.Thread(target=self._purge_in_background, name="blob-purge", daemon=True).start()
+
+    def _purge_in_background(self) -> None:
+        try:
+            removed = self.purge(self.ttl_seconds)
+            if removed:
+                print(f"[info] Purged {removed} expired blobs")
+        except Exception as e:
+            print(f"[warn] Blob purge failed: {e}")
+        finally:
+            self._purging = False
+
+    def spill(self, value: Any) -> Any:
+        """Return ``value``, or a reference if it is above the threshold."""
+        if not self.enabled or value is None or isinstance(value, (bool, int, float)):
+            return value
+        if is_blob_ref(value) or not _exceeds(value, self.threshold):
+            return value
+        return self.put(value)
+
+    def spill_fields(
+        self, mapping: Dict[str, Any], keep: Iterable[str] = ("port", "next")
+    ) -> Dict[str, Any]:
+        """Spill large top-level fields; returns ``mapping`` itself if none were."""
+        if not self.enabled or not isinstance(mapping, dict):
+            return mapping
+        out: Optional[Dict[str, Any]] = None
+        for k, v in mapping.items():
+            if k in keep:
+                continue
+            spilled = self.spill(v)
+            if spilled is not v:
+                if out is None:
+                    out = dict(mapping)
+                out[k] = spilled
+        return mapping if out is None else out
+
+    def purge(self, max_age_seconds: int) -> int:
+        """Delete blobs not modified for ``max_age_seconds``; returns the count."""
+        if not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+blob_store = BlobStore.from_env()
@@ -1,11 +1,31 @@
 import os
 import json
+import threading
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Any, Dict, List, Optional
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from engine.flow_versions import (
+    SNAPSHOT_EVERY,
+    apply_delta,
+    canonical_json,
+    content_hash,
+    make_delta,
+)
+from engine.security import hash_password
 
 # PostgreSQL database connection
 _conn: Optional[psycopg2.extensions.connection] = None
+# Pool for transactional writes: each caller gets its own session, so
+# advisory locks and rollbacks never touch another thread's transaction
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# Set once the schema has been created, so per-request init_db() calls are free
+_schema_ready = False
 
 # Database configuration from environment variables
 _DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
@@ -13,6 +33,7 @@ _DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 _DB_NAME = os.getenv("POSTGRES_DB", "flowart")
 _DB_USER = os.getenv("POSTGRES_USER", "postgres")
 _DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
+_DB_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
 
 
 def _get_conn() -> psycopg2.extensions.connection:
@@ -30,8 +51,38 @@ def _get_conn() -> psycopg2.extensions.connection:
     return _conn
 
 
+@contextmanager
+def _pooled_conn() -> Iterator[psycopg2.extensions.connection]:
+    """Borrow a dedicated connection for one transaction."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    1,
+                    _DB_POOL_MAX,
+                    host=_DB_HOST,
+                    port=_DB_PORT,
+                    dbname=_DB_NAME,
+                    user=_DB_USER,
+                    password=_DB_PASSWORD,
+                    cursor_factory=RealDictCursor,
+                )
+    conn = _pool.getconn()
+    try:
+        yield conn
+    finally:
+        # Roll back anything left open (errors included) before returning it
+        if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+            conn.rollback()
+        _pool.putconn(conn, close=bool(conn.closed))
+
+
 def init_db() -> None:
     """Initialize database schema if it does not exist."""
+    global _schema_ready
+    if _schema_ready:
+        return
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute(
@@ -51,6 +102,59 @@ def init_db() -> None:
         CREATE INDEX IF NOT EXISTS idx_flows_user ON flows(user_id)
         """
     )
+    # Keyset pagination (newest first) and name-prefix filtering per user
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_flows_user_id_desc ON flows(user_id, id DESC)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_flows_user_name ON flows(user_id, name text_pattern_ops)
+        """
+    )
+    # Versioned storage: flows.id is the stable flow id, flows.workflow holds
+    # the current version and flow_versions keeps the history.
+    cur.execute("ALTER TABLE flows ADD COLUMN IF NOT EXISTS current_version INTEGER")
+    cur.execute("ALTER TABLE flows ADD COLUMN IF NOT EXISTS content_hash TEXT")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flow_versions (
+            flow_id INTEGER NOT NULL REFERENCES flows(id) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            base_version INTEGER,
+            depth INTEGER NOT NULL DEFAULT 0,
+            snapshot TEXT,
+            delta TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (flow_id, version)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_flow_versions_hash ON flow_versions(flow_id, content_hash)
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)
+        """
+    )
+    cur.execute("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS fingerprint TEXT")
+    # A NULL result marks a key claimed by a run still in flight
+    cur.execute("ALTER TABLE idempotency_keys ALTER COLUMN result DROP NOT NULL")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -62,56 +166,270 @@ def init_db() -> None:
         )
         """
     )
+    # Issued webhook tokens; the tokens themselves are not stored, only
+    # their ids, so they can be listed and revoked
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_tokens (
+            jti TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            flow_id INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            revoked_at TIMESTAMP
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_webhook_tokens_user ON webhook_tokens(user_id)
+        """
+    )
     cur.close()
     _ensure_default_user(conn)
     conn.commit()
+    _schema_ready = True
+
+
+def db_save_flow(
+    user_id: str,
+    name: Optional[str],
+    workflow: Dict[str, Any],
+    flow_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Save a new version of a flow and return its id and version.
+
+    The flow is identified by ``flow_id`` or else by (user_id, name). Saving
+    content identical to an existing version does not add a row: the flow is
+    simply pointed at that version. New versions are stored as a line delta
+    against the current one, with a full snapshot every SNAPSHOT_EVERY saves.
+    """
+    text = canonical_json(workflow)
+    digest = content_hash(text)
+    wf_text = json.dumps(workflow, ensure_ascii=False)
+
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            if flow_id is not None:
+                cur.execute(
+                    "SELECT id, user_id, current_version, content_hash FROM flows WHERE id = %s FOR UPDATE",
+                    (flow_id,),
+                )
+                row = cur.fetchone()
+                if row is None or str(row["user_id"]) != str(user_id):
+                    raise ValueError(f"Flow {flow_id} not found for user")
+            else:
+                # Serialize concurrent first saves of the same (user_id, name)
+                cur.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{user_id}/{name}",)
+                )
+                cur.execute(
+                    "SELECT id, user_id, current_version, content_hash FROM flows"
+                    " WHERE user_id = %s AND name IS NOT DISTINCT FROM %s"
+                    " ORDER BY id DESC LIMIT 1 FOR UPDATE",
+                    (user_id, name),
+                )
+                row = cur.fetchone()
+
+            if row is None:
+                cur.execute(
+                    "INSERT INTO flows (user_id, name, workflow, current_version, content_hash)"
+                    " VALUES (%s, %s, %s, 1, %s) RETURNING id",
+                    (user_id, name, wf_text, digest),
+                )
+                new_id = int(cur.fetchone()["id"])
+                cur.execute(
+                    "INSERT INTO flow_versions (flow_id, version, content_hash, snapshot)"
+                    " VALUES (%s, 1, %s, %s)",
+                    (new_id, digest, text),
+                )
+                conn.commit()
+                return {"id": new_id, "version": 1, "content_hash": digest, "created": True}
+
+            fid = int(row["id"])
+            current = row["current_version"]
+            if current is not None and row["content_hash"] == digest:
+                conn.rollback()
+                return {"id": fid, "version": int(current), "content_hash": digest, "created": False}
+
+            cur.execute(
+                "SELECT version FROM flow_versions WHERE flow_id = %s AND content_hash = %s"
+                " ORDER BY version DESC LIMIT 1",
+                (fid, digest),
+            )
+            existing = cur.fetchone()
+            created = existing is None
+            if existing is not None:
+                version = int(existing["version"])
+            else:
+                cur.execute(
+                    "SELECT COALESCE(MAX(version), 0) AS v FROM flow_versions WHERE flow_id = %s",
+                    (fid,),
+                )
+                version = int(cur.fetchone()["v"]) + 1
+                base_text: Optional[str] = None
+                depth = 0
+                if current is not None:
+                    cur.execute(
+                        "SELECT depth FROM flow_versions WHERE flow_id = %s AND version = %s",
+                        (fid, current),
+                    )
+                    base = cur.fetchone()
+                    if base is not None and int(base["depth"]) + 1 < SNAPSHOT_EVERY:
+                        base_text = _version_text(cur, fid, int(current))
+                        depth = int(base["depth"]) + 1
+                if base_text is None:
+                    cur.execute(
+                        "INSERT INTO flow_versions (flow_id, version, content_hash, snapshot)"
+                        " VALUES (%s, %s, %s, %s)",
+                        (fid, version, digest, text),
+                    )
+                else:
+                    cur.execute(
+                        "INSERT INTO flow_versions"
+                        " (flow_id, version, content_hash, base_version, depth, delta)"
+                        " VALUES (%s, %s, %s, %s, %s, %s)",
+                        (fid, version, digest, current, depth, make_delta(base_text, text)),
+                    )
+
+            cur.execute(
+                "UPDATE flows SET workflow = %s, current_version = %s, content_hash = %s,"
+                " updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (wf_text, version, digest, fid),
+            )
+            conn.commit()
+            return {"id": fid, "version": version, "content_hash": digest, "created": created}
+        finally:
+            cur.close()
+
+
+def _version_text(cur: Any, flow_id: int, version: int) -> str:
+    """Rebuild the canonical JSON of a version from its snapshot and deltas."""
+    cur.execute(
+        """
+        WITH RECURSIVE chain AS (
+            SELECT version, base_version, snapshot, delta, 0 AS hops
+            FROM flow_versions WHERE flow_id = %s AND version = %s
+            UNION ALL
+            SELECT v.version, v.base_version, v.snapshot, v.delta, c.hops + 1
+            FROM flow_versions v JOIN chain c
+              ON v.flow_id = %s AND v.version = c.base_version
+            WHERE c.snapshot IS NULL
+        )
+        SELECT snapshot, delta FROM chain ORDER BY hops DESC
+        """,
+        (flow_id, version, flow_id),
+    )
+    rows = cur.fetchall()
+    if not rows or rows[0]["snapshot"] is None:
+        raise KeyError(f"Flow {flow_id} has no version {version}")
+    text = rows[0]["snapshot"]
+    for r in rows[1:]:
+        text = apply_delta(text, r["delta"])
+    return text
+
+
+@lru_cache(maxsize=256)
+def _load_version(flow_id: int, version: int) -> Dict[str, Any]:
+    # Versions are immutable, so (flow_id, version) is a stable cache key.
+    # Cached workflows are shared between callers and must not be mutated.
+    cur = _get_conn().cursor()
+    try:
+        return json.loads(_version_text(cur, flow_id, version))
+    finally:
+        cur.close()
 
 
-def db_save_flow(user_id: str, name: Optional[str], workflow: Dict[str, Any]) -> int:
-    """Insert a new flow and return its integer ID."""
+def db_list_flow_versions(flow_id: int) -> List[Dict[str, Any]]:
+    """List the version history of a flow (metadata only), newest first."""
     conn = _get_conn()
     cur = conn.cursor()
-    wf_text = json.dumps(workflow, ensure_ascii=False)
     cur.execute(
-        "INSERT INTO flows (user_id, name, workflow) VALUES (%s, %s, %s) RETURNING id",
-        (user_id, name, wf_text),
+        "SELECT version, content_hash, base_version, (snapshot IS NOT NULL) AS is_snapshot,"
+        " created_at FROM flow_versions WHERE flow_id = %s ORDER BY version DESC",
+        (flow_id,),
     )
-    flow_id = cur.fetchone()["id"]
-    conn.commit()
+    rows = cur.fetchall()
     cur.close()
-    return int(flow_id)
+    return [dict(r) for r in rows]
+
+
+def db_list_flows(
+    user_id: str,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """List flows for a given user_id (without heavy workflow payload).
 
+    Results are ordered newest first and paginated by keyset: pass the last
+    ``id`` of the previous page as ``before_id`` to fetch the next one.
+    """
+    clauses = ["user_id = %s"]
+    params: List[Any] = [user_id]
+    if before_id is not None:
+        clauses.append("id < %s")
+        params.append(before_id)
+    if name_prefix:
+        escaped = (
+            name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        )
+        clauses.append("name LIKE %s")
+        params.append(escaped + "%")
+    if updated_since is not None:
+        clauses.append("updated_at >= %s")
+        params.append(updated_since)
+    params.append(limit)
 
-def db_list_flows(user_id: str) -> List[Dict[str, Any]]:
-    """List flows for a given user_id (without heavy workflow payload)."""
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, user_id, name, created_at, updated_at FROM flows WHERE user_id = %s ORDER BY id DESC",
-        (user_id,),
+        "SELECT id, user_id, name, created_at, updated_at FROM flows"
+        f" WHERE {' AND '.join(clauses)} ORDER BY id DESC LIMIT %s",
+        tuple(params),
     )
     rows = cur.fetchall()
     cur.close()
     return [dict(r) for r in rows]
 
 
-def db_get_flow(flow_id: int) -> Optional[Dict[str, Any]]:
-    """Fetch a flow by its ID. Returns None if not found."""
+def db_get_flow(flow_id: int, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Fetch a flow by its ID, optionally pinned to a version.
+
+    Without ``version`` the current version is returned. Returns None if the
+    flow or the requested version does not exist.
+    """
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, user_id, name, workflow, created_at, updated_at FROM flows WHERE id = %s",
+        "SELECT id, user_id, name, current_version, content_hash, created_at, updated_at"
+        " FROM flows WHERE id = %s",
         (flow_id,),
     )
     row = cur.fetchone()
-    cur.close()
     if row is None:
+        cur.close()
         return None
     out = dict(row)
+    ver = version if version is not None else out.get("current_version")
+    if ver is None:
+        # Legacy row saved before versioning: read the inline workflow
+        cur.execute("SELECT workflow FROM flows WHERE id = %s", (flow_id,))
+        wf_row = cur.fetchone()
+        cur.close()
+        try:
+            out["workflow"] = json.loads((wf_row or {}).get("workflow") or "{}")
+        except Exception:
+            out["workflow"] = {}
+        return out
+    cur.close()
     try:
-        out["workflow"] = json.loads(out.get("workflow") or "{}")
-    except Exception:
-        out["workflow"] = {}
+        out["workflow"] = _load_version(int(flow_id), int(ver))
+    except KeyError:
+        return None
+    out["version"] = int(ver)
     return out
 
 
@@ -122,7 +440,7 @@ def _ensure_default_user(conn: psycopg2.extensions.connection) -> None:
     if row is None:
         cur.execute(
             "INSERT INTO users (email, password, role) VALUES (%s, %s, %s)",
-            ("test@gmail.com", "123456789", "user"),
+            ("test@gmail.com", hash_password("123456789"), "user"),
         )
         conn.commit()
     cur.close()
@@ -143,6 +461,7 @@ def db_get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
 
 
 def db_create_user(email: str, password: str, role: str = "user") -> int:
+    """Insert a user; ``password`` must already be hashed."""
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute(
@@ -153,3 +472,152 @@ def db_create_user(email: str, password: str, role: str = "user") -> int:
     conn.commit()
     cur.close()
     return int(user_id)
+
+
+def db_update_user_password(user_id: int, password: str) -> None:
+    """Replace a user's stored password hash."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE users SET password = %s WHERE id = %s", (password, user_id))
+    conn.commit()
+    cur.close()
+
+
+def db_claim_idempotency_key(
+    key: str, fingerprint: Optional[str], lease_seconds: int
+) -> Dict[str, Any]:
+    """Claim an idempotency key for a run, unless a live row holds it.
+
+    Returns ``{"claimed": True}`` when the caller now owns the key (a pending
+    row expiring after ``lease_seconds``), else the existing row's
+    ``result`` (None while its run is in flight) and ``fingerprint``.
+    """
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "INSERT INTO idempotency_keys (key, result, fingerprint, expires_at)"
+                " VALUES (%s, NULL, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')"
+                " ON CONFLICT (key) DO UPDATE SET result = NULL,"
+                " fingerprint = EXCLUDED.fingerprint,"
+                " created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at"
+                " WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP"
+                " RETURNING key",
+                (key, fingerprint, lease_seconds),
+            )
+            claimed = cur.fetchone() is not None
+            row = None
+            if not claimed:
+                cur.execute(
+                    "SELECT result, fingerprint FROM idempotency_keys WHERE key = %s",
+                    (key,),
+                )
+                row = cur.fetchone()
+            conn.commit()
+        finally:
+            cur.close()
+    if claimed or row is None:
+        # row is None: deleted between the two statements; retry later
+        return {"claimed": claimed, "result": None, "fingerprint": None}
+    result = json.loads(row["result"]) if row["result"] is not None else None
+    return {"claimed": False, "result": result, "fingerprint": row.get("fingerprint")}
+
+
+def db_release_idempotency_key(key: str) -> None:
+    """Drop a claim whose run failed or was abandoned, so a retry can run."""
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "DELETE FROM idempotency_keys WHERE key = %s AND result IS NULL", (key,)
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def db_put_idempotent_result(
+    key: str, result: Dict[str, Any], ttl_seconds: int, fingerprint: Optional[str] = None
+) -> None:
+    """Store the result for a claimed idempotency key and purge expired keys."""
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "INSERT INTO idempotency_keys (key, result, fingerprint, expires_at)"
+                " VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')"
+                " ON CONFLICT (key) DO UPDATE SET result = EXCLUDED.result,"
+                " fingerprint = EXCLUDED.fingerprint,"
+                " created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at"
+                " WHERE idempotency_keys.result IS NULL"
+                " OR idempotency_keys.expires_at <= CURRENT_TIMESTAMP",
+                (key, json.dumps(result, ensure_ascii=False), fingerprint, ttl_seconds),
+            )
+            cur.execute(
+                "DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys"
+                " WHERE expires_at <= CURRENT_TIMESTAMP LIMIT 100)"
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def db_create_webhook_token(jti: str, user_id: str, flow_id: int, ttl_seconds: int) -> None:
+    """Record an issued webhook token (its id, owner, flow and expiry)."""
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "INSERT INTO webhook_tokens (jti, user_id, flow_id, expires_at)"
+                " VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')",
+                (jti, str(user_id), int(flow_id), int(ttl_seconds)),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def db_list_webhook_tokens(user_id: str) -> List[Dict[str, Any]]:
+    """List a user's webhook tokens (ids and metadata only), newest first."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT jti, flow_id, created_at, expires_at, revoked_at FROM webhook_tokens"
+        " WHERE user_id = %s ORDER BY created_at DESC",
+        (str(user_id),),
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.commit()
+    return [dict(r) for r in rows]
+
+
+def db_revoke_webhook_token(jti: str, user_id: str) -> bool:
+    """Revoke one of the user's webhook tokens; False if it is not theirs."""
+    with _pooled_conn() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "UPDATE webhook_tokens SET revoked_at = COALESCE(revoked_at, CURRENT_TIMESTAMP)"
+                " WHERE jti = %s AND user_id = %s",
+                (jti, str(user_id)),
+            )
+            found = cur.rowcount > 0
+            conn.commit()
+        finally:
+            cur.close()
+    return found
+
+
+def db_list_revoked_webhook_jtis() -> List[str]:
+    """Ids of revoked webhook tokens that have not expired yet."""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT jti FROM webhook_tokens"
+        " WHERE revoked_at IS NOT NULL AND expires_at > CURRENT_TIMESTAMP"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.commit()
+    return [r["jti"] for r in rows]
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import contextvars
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional
+
+from engine.nodes import execution_for
+
+
+class NodeTimeout(Exception):
+    pass
+
+
+def _worker_main(conn: Connection) -> None:
+    """Child loop: receive (node_type, config, node_id), send back the result."""
+    from engine.nodes import NODE_HANDLERS
+
+    conn.send(("ready", None))
+    while True:
+        try:
+            node_type, config, node_id = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            handler = NODE_HANDLERS[node_type]
+            conn.send(("ok", handler(state={}, config=config, node_id=node_id)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx: Any) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout: float = 60.0) -> bool:
+        """Consume the worker's startup message once its imports are done."""
+        if not self.ready and self.conn.poll(timeout):
+            self.conn.recv()
+            self.ready = True
+        return self.ready
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessPool:
+    """Warm pool of worker processes for CPU-bound or untrusted node work.
+
+    Only the node type, resolved config and node id cross the process
+    boundary; handlers get an empty state. A worker that exceeds the timeout
+    (e.g. a catastrophic regex) is killed and replaced, so it cannot stall
+    other runs. Callers wait up to the same timeout for a free, ready worker and
+    then fail with NodeTimeout.
+    """
+
+    def __init__(self, size: int, default_timeout: float) -> None:
+        self.size = max(1, size)
+        self.default_timeout = default_timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self.replaced = 0
+
+    @classmethod
+    def from_env(cls) -> "ProcessPool":
+        return cls(
+            size=int(os.getenv("NODE_PROCESS_WORKERS") or max(2, os.cpu_count() or 1)),
+            default_timeout=float(os.getenv("NODE_PROCESS_TIMEOUT_SECONDS", "5")),
+        )
+
+    def start(self) -> None:
+        """Spawn the workers and wait until they can take work."""
+        fresh: List[_Worker] = []
+        with self._lock:
+            while len(self._workers) < self.size:
+                w = _Worker(self._ctx)
+                self._workers.append(w)
+                fresh.append(w)
+        for w in fresh:
+            w.wait_ready()
+            self._idle.put(w)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers, self._workers = self._workers, []
+            while not self._idle.empty():
+                self._idle.get_nowait()
+        for w in workers:
+            w.kill()
+
+    def _replace(self, w: _Worker) -> None:
+        w.kill()
+        fresh = _Worker(self._ctx)
+        with self._lock:
+            self._workers = [fresh if x is w else x for x in self._workers]
+            self.replaced += 1
+        self._idle.put(fresh)
+
+    def run(
+        self,
+        node_type: str,
+        config: Dict[str, Any],
+        node_id: str,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        if not self._workers:
+            self.start()
+        timeout = timeout or self.default_timeout
+        deadline = time.monotonic() + timeout
+        try:
+            w = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise NodeTimeout(
+                f"Node '{node_id}' found no free worker within {timeout:g}s"
+            )
+        try:
+            # A replacement worker may still be importing; never send it work
+            # before its "ready" message, or that message is read as the result.
+            if not w.wait_ready(max(0.0, deadline - time.monotonic())):
+                self._replace(w)
+                raise NodeTimeout(
+                    f"Node '{node_id}' found no ready worker within {timeout:g}s"
+                )
+            w.conn.send((node_type, config, node_id))
+            if not w.conn.poll(timeout):
+                self._replace(w)
+                raise NodeTimeout(f"Node '{node_id}' timed out after {timeout:g}s")
+            status, value = w.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            self._replace(w)
+            raise RuntimeError(f"Worker process for node '{node_id}' died")
+        self._idle.put(w)
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+
+class ThreadRunner:
+    """Shared thread pool for nodes that need a timeout but no isolation.
+    A timed-out handler keeps its thread until it returns on its own.
+    """
+
+    def __init__(self, size: int, default_timeout: float) -> None:
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, size), thread_name_prefix="node"
+        )
+
+    @classmethod
+    def from_env(cls) -> "ThreadRunner":
+        return cls(
+            size=int(os.getenv("NODE_THREAD_WORKERS", "16")),
+            default_timeout=float(os.getenv("NODE_THREAD_TIMEOUT_SECONDS", "30")),
+        )
+
+    def run(
+        self,
+        handler: Callable[..., Dict[str, Any]],
+        state: Any,
+        config: Dict[str, Any],
+        node_id: str,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        timeout = timeout or self.default_timeout
+        # Carry context variables (e.g. the run's stop callback) into the thread
+        ctx = contextvars.copy_context()
+        fut = self._executor.submit(
+            ctx.run, handler, state=state, config=config, node_id=node_id
+        )
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            fut.cancel()
+            raise NodeTimeout(f"Node '{node_id}' timed out after {timeout:g}s")
+
+
+process_pool = ProcessPool.from_env()
+thread_runner = ThreadRunner.from_env()
+
+
+def run_node(
+    node_type: str,
+    handler: Callable[..., Dict[str, Any]],
+    state: Any,
+    config: Dict[str, Any],
+    node_id: str,
+) -> Dict[str, Any]:
+    """Call ``handler`` in the execution class declared for ``node_type``."""
+    kind, timeout = execution_for(node_type, config)
+    if kind == "process":
+        return process_pool.run(node_type, config, node_id, timeout)
+    if kind == "thread":
+        return thread_runner.run(handler, state, config, node_id, timeout)
+    return handler(state=state, config=config, node_id=node_id)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FlowIndex:
+    """In-memory index of the flow JSON files stored in a directory.
+
+    The sorted file listing is rebuilt only when the directory mtime changes
+    (files added, removed or renamed), and parsed flows are cached per file
+    keyed by their (mtime_ns, size) so edits made outside the API are still
+    picked up. Cached workflows are shared between callers and must be
+    treated as read-only.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dir_mtime_ns: Optional[int] = None
+        self._names: List[str] = []
+        self._flows: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+    def list_names(self) -> List[str]:
+        """Return the sorted list of ``*.json`` file names."""
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if mtime_ns != self._dir_mtime_ns:
+                names = sorted(
+                    f for f in os.listdir(self.directory) if f.endswith(".json")
+                )
+                self._names = names
+                self._dir_mtime_ns = mtime_ns
+                # Drop cached flows whose files disappeared
+                for stale in set(self._flows) - set(names):
+                    self._flows.pop(stale, None)
+            return list(self._names)
+
+    def load(self, path: str) -> Dict[str, Any]:
+        """Return the parsed workflow stored at ``path`` (cached by stat)."""
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        fname = os.path.basename(path)
+        with self._lock:
+            cached = self._flows.get(fname)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._flows[fname] = (key, data)
+        return data
+
+    def store(self, path: str, workflow: Dict[str, Any]) -> None:
+        """Write ``workflow`` to ``path`` and refresh the cache entry.
+
+        Autosaves of unchanged content skip the disk write entirely.
+        """
+        fname = os.path.basename(path)
+        with self._lock:
+            cached = self._flows.get(fname)
+        if cached is not None and cached[1] == workflow:
+            try:
+                st = os.stat(path)
+                if (st.st_mtime_ns, st.st_size) == cached[0]:
+                    return
+            except FileNotFoundError:
+                pass
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(workflow, f, ensure_ascii=False, indent=2)
+        st = os.stat(path)
+        with self._lock:
+            self._flows[fname] = ((st.st_mtime_ns, st.st_size), workflow)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import difflib
+import hashlib
+import json
+from typing import Any, Dict, List
+
+# Store a full snapshot after this many consecutive deltas so that
+# rebuilding any version never replays a long chain.
+SNAPSHOT_EVERY = 16
+
+
+def canonical_json(workflow: Dict[str, Any]) -> str:
+    """Serialize a workflow deterministically, one JSON token per line.
+
+    Key order and whitespace never change the output, so identical flows
+    always hash the same and line deltas between versions stay small.
+    """
+    return json.dumps(workflow, sort_keys=True, ensure_ascii=False, indent=1)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_delta(base: str, target: str) -> str:
+    """Return a compact line delta turning ``base`` into ``target``.
+
+    The delta is a JSON list of ops: ``["c", start, end]`` copies
+    ``base`` lines [start, end) and ``["i", [lines...]]`` inserts new lines.
+    """
+    a = base.split("\n")
+    b = target.split("\n")
+    ops: List[Any] = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["i", b[j1:j2]])
+        # "delete": base lines are simply not copied
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(base: str, delta: str) -> str:
+    a = base.split("\n")
+    out: List[str] = []
+    for op in json.loads(delta):
+        if op[0] == "c":
+            out.extend(a[op[1]:op[2]])
+        else:
+            out.extend(op[1])
+    return "\n".join(out)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Type
+
+from engine.db import (
+    db_claim_idempotency_key,
+    db_put_idempotent_result,
+    db_release_idempotency_key,
+)
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable hash of the request parts a replayed result must match."""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def derive_key(payload: Dict[str, Any], fields: Iterable[str]) -> Optional[str]:
+    """Build a key from configured payload fields; None unless all are present."""
+    values = []
+    for field in fields:
+        if payload.get(field) is None:
+            return None
+        values.append(payload[field])
+    if not values:
+        return None
+    return json.dumps(values, sort_keys=True, default=str)
+
+
+class IdempotencyStore:
+    """Remember the first result of a run per idempotency key.
+
+    Results live in a bounded in-memory LRU with a TTL and, optionally, in the
+    ``idempotency_keys`` Postgres table so they survive restarts and are shared
+    between workers. Concurrent duplicates in this process wait for the
+    in-flight run instead of starting a second one; with the DB, a run first
+    claims its key with a pending row, and duplicates in other workers poll
+    that row until the result is stored (or the claim's ``claim_seconds``
+    lease runs out). Failed runs are not remembered, so a retry after an
+    error executes again.
+
+    Each key remembers the fingerprint of the request that first used it; a
+    reuse with a different fingerprint raises IdempotencyConflict instead of
+    replaying a result that belongs to another request.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: int = 86400,
+        use_db: bool = False,
+        claim_seconds: int = 600,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.use_db = use_db
+        self.claim_seconds = claim_seconds
+        self._results: "OrderedDict[str, Tuple[float, Optional[str], Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+        self._in_flight: Dict[str, Tuple[Optional[str], asyncio.Future]] = {}
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyStore":
+        return cls(
+            max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+            ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+            use_db=os.getenv("IDEMPOTENCY_DB", "false").lower() in ("1", "true", "yes"),
+            claim_seconds=int(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "600")),
+        )
+
+    @staticmethod
+    def scoped_key(*scope: str) -> str:
+        """Hash a key together with its scope (tenant, flow identity, ...)."""
+        return hashlib.sha256("\0".join(scope).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _check(stored: Optional[str], fp: Optional[str]) -> None:
+        if stored is not None and fp is not None and stored != fp:
+            raise IdempotencyConflict(
+                "Idempotency key was already used with a different request body"
+            )
+
+    def _get_cached(self, key: str) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        hit = self._results.get(key)
+        if hit is None:
+            return None
+        if hit[0] < time.monotonic():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return hit[1], hit[2]
+
+    def _put_cached(self, key: str, fp: Optional[str], result: Dict[str, Any]) -> None:
+        self._results[key] = (time.monotonic() + self.ttl_seconds, fp, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    async def _claim(
+        self, key: str, fp: Optional[str]
+    ) -> Tuple[bool, Optional[Dict[str, Any]], Optional[str]]:
+        """Claim ``key`` in the DB or wait for the worker holding it.
+        Returns (claimed, result, fingerprint); result is set when another
+        worker finished the run.
+        """
+        delay = 0.05
+        while True:
+            try:
+                row = await asyncio.to_thread(
+                    db_claim_idempotency_key, key, fp, self.claim_seconds
+                )
+            except Exception as db_e:
+                print(f"[warn] Idempotency claim failed: {db_e}")
+                return False, None, fp  # run without cross-worker dedup
+            if row["claimed"]:
+                return True, None, fp
+            self._check(row["fingerprint"], fp)
+            if row["result"] is not None:
+                return False, row["result"], row["fingerprint"]
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    @staticmethod
+    def _release(key: str) -> None:
+        try:
+            db_release_idempotency_key(key)
+        except Exception as db_e:
+            print(f"[warn] Idempotency release failed: {db_e}")
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]],
+        abandon: Tuple[Type[BaseException], ...] = (),
+        fp: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Return (result, replayed) for ``key``, executing ``fn`` at most once.
+        Exceptions in ``abandon`` mean the caller went away: like cancellation,
+        a waiting duplicate takes over the run instead of sharing the error.
+        ``fp`` is the request fingerprint; a mismatch raises IdempotencyConflict.
+        """
+        while True:
+            cached = self._get_cached(key)
+            if cached is not None:
+                self._check(cached[0], fp)
+                return cached[1], True
+            leader = self._in_flight.get(key)
+            if leader is None:
+                break
+            self._check(leader[0], fp)
+            fut = leader[1]
+            try:
+                return await asyncio.shield(fut), True
+            except _LeaderCancelled:
+                continue  # the original caller went away; take over the run
+
+        fut = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (fp, fut)
+        claimed = False
+        try:
+            result: Optional[Dict[str, Any]] = None
+            stored_fp = fp
+            if self.use_db:
+                claimed, result, stored_fp = await self._claim(key, fp)
+            replayed = result is not None
+            if result is None:
+                result = await fn()
+                if self.use_db:
+                    try:
+                        await asyncio.to_thread(
+                            db_put_idempotent_result, key, result, self.ttl_seconds, fp
+                        )
+                    except Exception as db_e:
+                        print(f"[warn] Idempotency store failed: {db_e}")
+                        if claimed:
+                            # Let duplicates elsewhere run instead of polling
+                            await asyncio.to_thread(self._release, key)
+            self._put_cached(key, stored_fp, result)
+            fut.set_result(result)
+            return result, replayed
+        except (asyncio.CancelledError, *abandon):
+            fut.set_exception(_LeaderCancelled())
+            if claimed:
+                # Not awaited: this task may already be cancelled
+                asyncio.get_running_loop().run_in_executor(None, self._release, key)
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            if claimed:
+                asyncio.get_running_loop().run_in_executor(None, self._release, key)
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+            # Nobody may be waiting; mark the exception as retrieved
+            if fut.done() and not fut.cancelled():
+                fut.exception()
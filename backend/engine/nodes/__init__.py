@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Dict
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import yaml
 
 from engine.nodes.actions.chat import action_chat
 from engine.nodes.actions.send_email import action_send_email
 from engine.nodes.actions.send_sms import action_send_sms
 from engine.nodes.condition import logic_condition
 from engine.nodes.end import logic_end
+from engine.nodes.for_each import logic_for_each
+from engine.nodes.switch import logic_switch
 from engine.nodes.trigger import trigger_webhook
 
 Handler = Callable[[Dict[str, Any], Dict[str, Any], str], Dict[str, Any]]
@@ -18,4 +24,79 @@ NODE_HANDLERS: Dict[str, Handler] = {
     "action.send_email": action_send_email,
     "logic.condition": logic_condition,
     "logic.end": logic_end,
+    "logic.for_each": logic_for_each,
+    "logic.switch": logic_switch,
+}
+
+# Config keys passed to the handler as-is instead of being template-rendered
+# (sub-graphs whose templates resolve per item, raw list references, case
+# tables compiled once per flow).
+RAW_CONFIG_KEYS: Dict[str, Tuple[str, ...]] = {
+    "logic.for_each": ("items", "body"),
+    "logic.switch": ("cases",),
 }
+
+NODES_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "nodes_config.yml")
+
+# Where a node's handler runs (see nodes_config.yml "execution"):
+#   inline  - in the runner thread (default)
+#   thread  - in a shared thread pool, abandoned after the timeout
+#   process - in a warm worker process, killed and replaced on timeout
+EXECUTION_CLASSES = ("inline", "thread", "process")
+
+_config_lock = threading.Lock()
+# node type -> (execution class, timeout seconds, execution_when)
+_Execution = Tuple[str, Optional[float], Dict[str, Any]]
+_config_cache: Optional[Tuple[int, Dict[str, Any], Dict[str, _Execution]]] = None
+
+
+def _load() -> Tuple[Dict[str, Any], Dict[str, _Execution]]:
+    global _config_cache
+    mtime_ns = os.stat(NODES_CONFIG_PATH).st_mtime_ns
+    with _config_lock:
+        if _config_cache is not None and _config_cache[0] == mtime_ns:
+            return _config_cache[1], _config_cache[2]
+    with open(NODES_CONFIG_PATH, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    execution: Dict[str, _Execution] = {}
+    for node in data.get("nodes") or []:
+        kind = node.get("execution") or "inline"
+        if kind not in EXECUTION_CLASSES:
+            print(f"[warn] Unknown execution '{kind}' for {node.get('type')}; using inline")
+            kind = "inline"
+        timeout = node.get("timeout_seconds")
+        when = node.get("execution_when") or {}
+        if not isinstance(when, dict):
+            print(f"[warn] execution_when for {node.get('type')} must be a mapping; ignored")
+            when = {}
+        execution[str(node.get("type"))] = (kind, float(timeout) if timeout else None, when)
+    with _config_lock:
+        _config_cache = (mtime_ns, data, execution)
+    return data, execution
+
+
+def load_nodes_config() -> Dict[str, Any]:
+    """Parsed nodes_config.yml, cached until the file changes (read-only)."""
+    return _load()[0]
+
+
+def execution_for(
+    node_type: str, config: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Optional[float]]:
+    """Return (execution class, timeout seconds or None) for a node type.
+
+    With ``config``, a node type that declares ``execution_when`` only gets
+    its execution class when every listed config key has one of the listed
+    values; other configs run inline.
+    """
+    try:
+        execution = _load()[1]
+    except FileNotFoundError:
+        return "inline", None
+    kind, timeout, when = execution.get(node_type, ("inline", None, {}))
+    if config is not None and when:
+        for key, allowed in when.items():
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            if config.get(key) not in allowed:
+                return "inline", None
+    return kind, timeout
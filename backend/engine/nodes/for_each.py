@@ -0,0 +1,136 @@
+from collections import ChainMap
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set
+
+from engine.blob_store import blob_store, estimate_size
+from engine.template_resolver import resolve_value
+
+_MAX_CONCURRENCY = 32
+_MAX_BYTES = 16 * 1024 * 1024
+
+
+def _as_int(value: Any, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def logic_for_each(
+    state: Dict[str, Any], config: Dict[str, Any], node_id: str
+) -> Dict[str, Any]:
+    """Run a body sub-graph once per element of a list.
+
+    Config:
+      - items: list reference, e.g. {{payload.recipients}} (not stringified)
+      - body: sub-workflow {nodes, edges, entry}; its templates can use
+        {{item...}} and {{index}} besides the parent's payload and nodes
+      - concurrency: items executed at once (default 4, max 32)
+      - max_items: refuse lists longer than this (default 1000)
+      - max_bytes: refuse larger item lists, and cap the results kept in
+        memory; beyond it item results are spilled to the blob store
+        (default 16 MiB)
+      - collect: optional body node id whose outputs become the item result;
+        by default the item result holds all body node outputs
+      - fail_fast: stop starting new items after the first failure
+    """
+    # Local import: the runner imports the node registry
+    from engine.workflow_runner import WorkflowCancelled, current_should_stop, execute_workflow
+
+    items = resolve_value(config.get("items"), state)
+    body = config.get("body")
+    if items is None:
+        items = []
+    if not isinstance(items, list):
+        raise ValueError("for_each: 'items' must reference a list")
+    if not isinstance(body, dict) or not body.get("nodes"):
+        raise ValueError("for_each: 'body' must be a workflow with nodes")
+
+    max_items = _as_int(config.get("max_items"), 1000)
+    if len(items) > max_items:
+        raise ValueError(
+            f"for_each: {len(items)} items exceeds max_items={max_items}"
+        )
+    max_bytes = _as_int(config.get("max_bytes"), _MAX_BYTES)
+    if estimate_size(items, max_bytes) > max_bytes:
+        raise ValueError(f"for_each: items exceed max_bytes={max_bytes}")
+    concurrency = min(max(_as_int(config.get("concurrency"), 4), 1), _MAX_CONCURRENCY)
+    collect: Optional[str] = config.get("collect") or None
+    fail_fast = bool(config.get("fail_fast"))
+    should_stop = current_should_stop()
+
+    def run_item(index: int, item: Any) -> Any:
+        # Layer per-item keys over the parent state instead of copying it:
+        # reads fall through to the parent, writes stay in the item's maps.
+        item_state = ChainMap(
+            {"nodes": ChainMap({}, state.get("nodes", {})), "item": item, "index": index},
+            state,
+        )
+        execute_workflow(body, item_state, should_stop)
+        own_nodes = item_state["nodes"].maps[0]
+        for entry in item_state.get("logs", []):
+            if entry.get("status") == "error":
+                raise RuntimeError(f"{entry.get('id')}: {entry.get('error')}")
+        if collect:
+            return own_nodes.get(collect)
+        return own_nodes
+
+    kept_bytes = 0
+
+    def keep(result: Any) -> Any:
+        # Large results go to the blob store; once the inline total would pass
+        # max_bytes, every further result is spilled regardless of size.
+        nonlocal kept_bytes
+        result = blob_store.spill(result)
+        size = estimate_size(result, max_bytes)
+        if kept_bytes + size > max_bytes:
+            if not blob_store.enabled:
+                raise ValueError(f"for_each: results exceed max_bytes={max_bytes}")
+            result = blob_store.put(result)
+            size = estimate_size(result)
+        kept_bytes += size
+        return result
+
+    results: List[Any] = [None] * len(items)
+    failed = 0
+    pending: Set[Future] = set()
+    index_of: Dict[Future, int] = {}
+    next_index = 0
+    stop = False
+    # At most `concurrency` item states exist at a time; each is dropped as
+    # soon as its result has been collected.
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix=f"for_each-{node_id}"
+    ) as pool:
+        while pending or (next_index < len(items) and not stop):
+            if should_stop is not None and should_stop():
+                stop = True
+            while not stop and next_index < len(items) and len(pending) < concurrency:
+                fut = pool.submit(run_item, next_index, items[next_index])
+                index_of[fut] = next_index
+                pending.add(fut)
+                next_index += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                idx = index_of.pop(fut)
+                try:
+                    result = fut.result()
+                except WorkflowCancelled:
+                    # The run was stopped; pending items stop at their next node
+                    raise
+                except Exception as e:
+                    failed += 1
+                    results[idx] = {"error": str(e)}
+                    stop = stop or fail_fast
+                    continue
+                results[idx] = keep(result)
+    skipped = len(items) - next_index
+
+    print(f"[ FOR_EACH ] {len(items)} items, {failed} failed, {skipped} skipped.")
+    return {
+        "results": results[:next_index],
+        "count": next_index,
+        "failed": failed,
+        "skipped": skipped,
+        "port": "error" if failed else "success",
+    }
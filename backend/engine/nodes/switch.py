@@ -0,0 +1,128 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+_MATCH_MODES = ("exact", "prefix", "range")
+_TABLE_CACHE_SIZE = 256
+
+# Compiled case tables keyed by the identity of the workflow's "cases" object.
+# "cases" is a raw config key, so every execution of a node sees the same dict:
+# a table is compiled once per /run-flow request and once per cached DB flow
+# version. Entries hold the dict, so its id cannot be reused while cached.
+_tables: "OrderedDict[Tuple[int, str, bool], Tuple[Dict[Any, Any], Any]]" = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def _norm(value: Any, case_insensitive: bool) -> Any:
+    if isinstance(value, str):
+        return value.casefold() if case_insensitive else value
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _compile(cases: Dict[Any, Any], match: str, case_insensitive: bool) -> Any:
+    if match == "range":
+        # Lower bounds sorted ascending; a key falls in the last bound <= key
+        bounds = sorted((float(k), str(port)) for k, port in cases.items())
+        return [b for b, _ in bounds], [p for _, p in bounds]
+    table = {_norm(str(k), case_insensitive): str(port) for k, port in cases.items()}
+    if match == "prefix":
+        prefixes = sorted(table)
+        return prefixes, [table[p] for p in prefixes]
+    return table
+
+
+def _table(cases: Dict[Any, Any], match: str, case_insensitive: bool) -> Any:
+    if not cases:
+        return _compile(cases, match, case_insensitive)
+    key = (id(cases), match, case_insensitive)
+    with _tables_lock:
+        hit = _tables.get(key)
+        if hit is not None:
+            _tables.move_to_end(key)
+            return hit[1]
+    compiled = _compile(cases, match, case_insensitive)
+    with _tables_lock:
+        _tables[key] = (cases, compiled)
+        _tables.move_to_end(key)
+        while len(_tables) > _TABLE_CACHE_SIZE:
+            _tables.popitem(last=False)
+    return compiled
+
+
+def _longest_prefix(prefixes: List[str], key: str) -> Optional[int]:
+    """Index of the longest prefix of ``key`` in sorted ``prefixes``."""
+    hi = len(prefixes)
+    probe = key
+    while True:
+        i = bisect_right(prefixes, probe, 0, hi) - 1
+        if i < 0:
+            return None
+        candidate = prefixes[i]
+        if key.startswith(candidate):
+            return i
+        # Only prefixes of the common part can still match; they sort before it
+        common = 0
+        for a, b in zip(candidate, key):
+            if a != b:
+                break
+            common += 1
+        probe, hi = key[:common], i
+
+
+def logic_switch(
+    state: Dict[str, Any], config: Dict[str, Any], node_id: str
+) -> Dict[str, Any]:
+    """Route on one value through a case table instead of chained conditions.
+
+    Config:
+      - key: value to match, e.g. {{payload.country}}
+      - cases: {value: port} (for range: {lower_bound: port})
+      - match: exact (default, hash lookup), prefix (longest prefix wins)
+        or range (numeric key >= bound, highest bound wins)
+      - case_insensitive: compare strings case-folded
+      - default: port used when no case matches (default "default"); also
+        used when a matched case's port has no edge. If the default port
+        has no edge either, the path ends here
+    """
+    key = config.get("key")
+    cases = config.get("cases") or {}
+    match = (config.get("match") or "exact").strip().lower()
+    case_insensitive = bool(config.get("case_insensitive"))
+    default = str(config.get("default") or "default")
+    if not isinstance(cases, dict):
+        raise ValueError("switch: 'cases' must be an object of value -> port")
+    if match not in _MATCH_MODES:
+        raise ValueError(f"switch: unknown match '{match}'")
+
+    table = _table(cases, match, case_insensitive)
+    matched: Optional[str] = None
+    port: Optional[str] = None
+    if match == "exact":
+        port = table.get(_norm(key, case_insensitive))
+        if port is None and not isinstance(key, str) and key is not None:
+            # JSON case keys are strings; let 42 match "42"
+            port = table.get(_norm(str(key), case_insensitive))
+        matched = key if port is not None else None
+    elif match == "prefix":
+        if key is not None:
+            prefixes, ports = table
+            i = _longest_prefix(prefixes, _norm(str(key), case_insensitive))
+            if i is not None:
+                matched, port = prefixes[i], ports[i]
+    else:
+        bounds, ports = table
+        try:
+            number = float(key)
+        except (TypeError, ValueError):
+            number = None
+        if number is not None:
+            i = bisect_right(bounds, number) - 1
+            if i >= 0:
+                matched, port = bounds[i], ports[i]
+
+    port = port or default
+    print("[ SWITCH ] Key:", key, "-> port:", port)
+    return {"key": key, "matched": matched, "port": port, "default_port": default}
@@ -0,0 +1,79 @@
+"""Local stand-ins for provider nodes (chat, SMS, email) used by load replays.
+
+Enabled in-process by ``scripts/replay.py`` or, for a running server, with
+``PROVIDER_MOCKS`` read at startup, e.g.
+``PROVIDER_MOCKS="action.chat=300:100,action.send_sms=50"`` (``true`` mocks
+without added latency).
+"""
+
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+_PROVIDER_TYPES = ("action.chat", "action.send_sms", "action.send_email")
+_ENABLED = ("1", "true", "yes", "on")
+
+Latency = Dict[str, Tuple[float, float]]
+
+# Real handlers replaced by install_mocks, so installing twice does not stack delays
+_originals: Dict[str, Any] = {}
+
+
+def parse_latency(specs: Iterable[str]) -> Latency:
+    """Parse 'node.type=MEAN_MS[:JITTER_MS]' specs into seconds."""
+    out: Latency = {}
+    for spec in specs:
+        node_type, _, value = spec.partition("=")
+        mean, _, jitter = value.partition(":")
+        try:
+            out[node_type.strip()] = (float(mean) / 1000.0, float(jitter or 0) / 1000.0)
+        except ValueError:
+            raise ValueError(f"Invalid latency '{spec}' (expected type=ms[:jitter_ms])")
+    return out
+
+
+def install_mocks(latency: Latency) -> None:
+    """Replace provider nodes with local mocks that sleep for the given latency."""
+    from engine.nodes import NODE_HANDLERS
+
+    def _sleep(node_type: str) -> None:
+        mean, jitter = latency.get(node_type, (0.0, 0.0))
+        delay = max(0.0, random.uniform(mean - jitter, mean + jitter))
+        if delay:
+            time.sleep(delay)
+
+    def mock_chat(state: Dict[str, Any], config: Dict[str, Any], node_id: str) -> Dict[str, Any]:
+        _sleep("action.chat")
+        text = json.dumps({"message": "mock reply", "subject": "mock", "body": "mock"})
+        return {
+            "generated_response": json.loads(text),
+            "generated_message": "mock reply",
+            "raw_text": text,
+            "port": "success",
+        }
+
+    def wrap(node_type: str, handler):
+        def mocked(state: Dict[str, Any], config: Dict[str, Any], node_id: str) -> Dict[str, Any]:
+            _sleep(node_type)
+            return handler(state=state, config=config, node_id=node_id)
+
+        return mocked
+
+    for node_type in (*_PROVIDER_TYPES, *latency):
+        if node_type in NODE_HANDLERS:
+            _originals.setdefault(node_type, NODE_HANDLERS[node_type])
+    for node_type, handler in _originals.items():
+        NODE_HANDLERS[node_type] = wrap(node_type, handler)
+    NODE_HANDLERS["action.chat"] = mock_chat
+
+
+def latency_from_env() -> Optional[Latency]:
+    """Latency spec from PROVIDER_MOCKS, or None when mocks are disabled."""
+    raw = os.getenv("PROVIDER_MOCKS", "").strip()
+    if not raw or raw.lower() in ("0", "false", "no", "off"):
+        return None
+    if raw.lower() in _ENABLED:
+        return {}
+    return parse_latency(s for s in raw.split(",") if s.strip())
@@ -0,0 +1,465 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# Strict priority between classes, weighted fair queueing within a class
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+_WAIT_SAMPLES = 1024
+
+# Metrics label for callers without an identity (no quotas, global limit only)
+UNIDENTIFIED = "(unidentified)"
+
+
+class QuotaExceeded(Exception):
+    """A tenant is over its own quota (HTTP 429)."""
+
+    status_code = 429
+
+    def __init__(self, detail: str, retry_after: float) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Overloaded(QuotaExceeded):
+    """The server is shedding load (HTTP 503)."""
+
+    status_code = 503
+
+
+class _Waiter:
+    __slots__ = ("fut", "deadline")
+
+    def __init__(self, fut: asyncio.Future, deadline: Optional[float]) -> None:
+        self.fut = fut
+        self.deadline = deadline
+
+
+# (deadline, sequence, waiter): earliest deadline first, FIFO among equals
+_Entry = Tuple[float, int, _Waiter]
+
+
+class _Tenant:
+    def __init__(
+        self, tid: str, weight: float, max_priority: str, burst: float, limited: bool = True
+    ) -> None:
+        self.tid = tid
+        self.weight = weight
+        self.max_priority = max_priority
+        # Unidentified callers share one entry that is exempt from tenant quotas
+        self.limited = limited
+        self.in_flight = 0
+        self.vtime = 0.0
+        self.queues: Dict[str, List[_Entry]] = {p: [] for p in PRIORITIES}
+        # Sequence number of this tenant's live entry in each ready heap
+        self.ready_seq: Dict[str, Optional[int]] = {p: None for p in PRIORITIES}
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.last_active = self.last_refill
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.waits_ms: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.wait_max_ms = 0.0
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def remove(self, waiter: _Waiter) -> bool:
+        for q in self.queues.values():
+            for i, entry in enumerate(q):
+                if entry[2] is waiter:
+                    q[i] = q[-1]
+                    q.pop()
+                    heapq.heapify(q)
+                    return True
+        return False
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    """Parse 'a=1,b=2' style env values."""
+    out: Dict[str, str] = {}
+    for part in raw.split(","):
+        key, sep, val = part.partition("=")
+        if sep and key.strip():
+            out[key.strip()] = val.strip()
+    return out
+
+
+class TenantScheduler:
+    """Admission layer for flow runs, keyed by tenant (user_id).
+
+    Each tenant gets a token-bucket rate quota, a max-in-flight limit and a
+    bounded queue. Free execution slots are handed out by strict priority
+    class, then by start-time fair queueing on per-tenant virtual time, so a
+    bursting tenant only ever gets its weighted share of the workers.
+
+    Callers without an identity (tenant_id None) are not subject to tenant
+    quotas, only to the global limits. Tenants with waiters are kept in
+    per-priority heaps, so dispatch cost does not grow with the number of
+    known tenants, and idle tenants are evicted after ``tenant_idle_seconds``.
+
+    Runs may carry a deadline (a time.monotonic() value). Queues are kept in
+    deadline order, and a running estimate of run time decides whether a
+    queued request can still finish in time; those that cannot are shed
+    with Overloaded instead of taking a slot. A request that finds a free
+    slot always runs. When the global queue is full, hopeless waiters are
+    dropped first, then newcomers are rejected. Samples are capped at
+    ``est_cap`` and the estimate halves every ``est_half_life`` seconds
+    without completions, so one slow run cannot block admission for long.
+
+    All state is owned by the event loop; no locking is needed as long as
+    acquire/release are called from it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        tenant_max_in_flight: int = 8,
+        tenant_rate: float = 20.0,
+        tenant_burst: float = 40.0,
+        tenant_max_queue: int = 100,
+        max_queue: int = 1000,
+        weights: Optional[Dict[str, float]] = None,
+        max_priorities: Optional[Dict[str, str]] = None,
+        tenant_idle_seconds: float = 300.0,
+        est_cap: float = 10.0,
+        est_half_life: float = 30.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.tenant_max_in_flight = tenant_max_in_flight
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.tenant_max_queue = tenant_max_queue
+        self.max_queue = max_queue
+        self.weights = weights or {}
+        self.max_priorities = max_priorities or {}
+        self.tenant_idle_seconds = tenant_idle_seconds
+        self.running = 0
+        self.queued_total = 0
+        self.shed_total = 0
+        # EWMA of run time (seconds), used to judge deadline feasibility
+        self.est_cap = est_cap
+        self.est_half_life = est_half_life
+        self._est = 0.0
+        self._est_at = time.monotonic()
+        self._vclock = 0.0
+        self._seq = itertools.count()
+        self._tenants: Dict[str, _Tenant] = {}
+        self._unidentified = _Tenant(UNIDENTIFIED, 1.0, DEFAULT_PRIORITY, 0.0, limited=False)
+        # Per priority: (start tag, seq, tenant) for tenants with waiters
+        self._ready: Dict[str, List[Tuple[float, int, _Tenant]]] = {p: [] for p in PRIORITIES}
+        # (deadline, seq, tenant, waiter) for queued waiters with a deadline
+        self._deadlines: List[Tuple[float, int, _Tenant, _Waiter]] = []
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "TenantScheduler":
+        return cls(
+            max_concurrency=int(os.getenv("RUN_MAX_CONCURRENCY", "32")),
+            tenant_max_in_flight=int(os.getenv("TENANT_MAX_IN_FLIGHT", "8")),
+            tenant_rate=float(os.getenv("TENANT_RATE_PER_SEC", "20")),
+            tenant_burst=float(os.getenv("TENANT_BURST", "40")),
+            tenant_max_queue=int(os.getenv("TENANT_MAX_QUEUE", "100")),
+            max_queue=int(os.getenv("RUN_MAX_QUEUE", "1000")),
+            weights={
+                k: float(v)
+                for k, v in _parse_mapping(os.getenv("TENANT_WEIGHTS", "")).items()
+            },
+            max_priorities=_parse_mapping(os.getenv("TENANT_PRIORITIES", "")),
+            tenant_idle_seconds=float(os.getenv("TENANT_IDLE_SECONDS", "300")),
+            est_cap=float(os.getenv("RUN_ESTIMATE_CAP_MS", "10000")) / 1000.0,
+            est_half_life=float(os.getenv("RUN_ESTIMATE_HALF_LIFE_SECONDS", "30")),
+        )
+
+    @property
+    def est_run_time(self) -> float:
+        """Current run-time estimate, decayed since the last completion."""
+        if self._est <= 0.0 or self.est_half_life <= 0:
+            return self._est
+        age = time.monotonic() - self._est_at
+        return self._est * 0.5 ** (age / self.est_half_life)
+
+    def _tenant(self, tenant_id: Optional[str]) -> _Tenant:
+        if tenant_id is None:
+            return self._unidentified
+        t = self._tenants.get(tenant_id)
+        if t is None:
+            max_priority = self.max_priorities.get(tenant_id, DEFAULT_PRIORITY)
+            if max_priority not in PRIORITIES:
+                max_priority = DEFAULT_PRIORITY
+            t = _Tenant(
+                tenant_id,
+                weight=max(self.weights.get(tenant_id, 1.0), 0.001),
+                max_priority=max_priority,
+                burst=self.tenant_burst,
+            )
+            self._tenants[tenant_id] = t
+        return t
+
+    def _evict_idle(self, now: float) -> None:
+        """Drop tenants with nothing running or queued and a full token bucket."""
+        if now - self._last_sweep < self.tenant_idle_seconds / 2:
+            return
+        self._last_sweep = now
+        cutoff = now - self.tenant_idle_seconds
+        for tid in [
+            tid
+            for tid, t in self._tenants.items()
+            if t.in_flight == 0
+            and t.last_active < cutoff
+            and not t.queued()
+            and (
+                self.tenant_rate <= 0
+                or t.tokens + (now - t.last_refill) * self.tenant_rate >= self.tenant_burst
+            )
+        ]:
+            del self._tenants[tid]
+
+    def _blocked(self, t: _Tenant) -> bool:
+        return t.limited and t.in_flight >= self.tenant_max_in_flight
+
+    def _mark_ready(self, t: _Tenant, prio: str) -> None:
+        """Put ``t`` in the ready heap for ``prio`` if it can be served."""
+        if t.ready_seq[prio] is not None or not t.queues[prio] or self._blocked(t):
+            return
+        seq = next(self._seq)
+        t.ready_seq[prio] = seq
+        heapq.heappush(self._ready[prio], (max(t.vtime, self._vclock), seq, t))
+
+    def _priority(self, t: _Tenant, requested: Optional[str]) -> str:
+        # Callers may lower their priority but not exceed their tenant's class
+        prio = requested if requested in PRIORITIES else DEFAULT_PRIORITY
+        return PRIORITIES[max(PRIORITIES.index(prio), PRIORITIES.index(t.max_priority))]
+
+    def _take_token(self, t: _Tenant) -> None:
+        if self.tenant_rate <= 0 or not t.limited:
+            return
+        now = time.monotonic()
+        t.tokens = min(
+            self.tenant_burst, t.tokens + (now - t.last_refill) * self.tenant_rate
+        )
+        t.last_refill = now
+        if t.tokens < 1.0:
+            t.rejected += 1
+            raise QuotaExceeded(
+                "Tenant rate limit exceeded", (1.0 - t.tokens) / self.tenant_rate
+            )
+        t.tokens -= 1.0
+
+    def _start(self, t: _Tenant) -> None:
+        start = max(t.vtime, self._vclock)
+        t.vtime = start + 1.0 / t.weight
+        self._vclock = start
+        t.in_flight += 1
+        self.running += 1
+
+    def _has_waiters(self) -> bool:
+        return self.queued_total > 0
+
+    def _hopeless(self, deadline: Optional[float], now: float) -> bool:
+        return deadline is not None and now + self.est_run_time > deadline
+
+    def _retry_after(self) -> float:
+        # Roughly the time needed to drain the current queue
+        backlog = self.queued_total / max(self.max_concurrency, 1)
+        return max(1.0, self.est_run_time * backlog)
+
+    def _shed(self, t: _Tenant, detail: str) -> Overloaded:
+        t.shed += 1
+        self.shed_total += 1
+        return Overloaded(detail, self._retry_after())
+
+    def _next_ready(self) -> Optional[Tuple[_Tenant, str]]:
+        """Pop the tenant with the smallest start tag in the highest class."""
+        for prio in PRIORITIES:
+            heap = self._ready[prio]
+            while heap:
+                _, seq, t = heapq.heappop(heap)
+                if t.ready_seq[prio] != seq:
+                    continue  # stale entry
+                t.ready_seq[prio] = None
+                if t.queues[prio] and not self._blocked(t):
+                    return t, prio
+        return None
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self.running < self.max_concurrency:
+            picked = self._next_ready()
+            if picked is None:
+                return
+            t, prio = picked
+            _, _, waiter = heapq.heappop(t.queues[prio])
+            self.queued_total -= 1
+            if not waiter.fut.done():
+                if self._hopeless(waiter.deadline, now):
+                    waiter.fut.set_exception(self._shed(t, "Deadline cannot be met"))
+                else:
+                    self._start(t)
+                    waiter.fut.set_result(None)
+            # Re-enter the heap with the new start tag if more are waiting
+            self._mark_ready(t, prio)
+
+    def _shed_hopeless(self, now: float) -> bool:
+        """Drop the queued waiter with the earliest unmeetable deadline."""
+        heap = self._deadlines
+        while heap and heap[0][3].fut.done():
+            heapq.heappop(heap)
+        if not heap or not self._hopeless(heap[0][0], now):
+            return False
+        _, _, t, waiter = heapq.heappop(heap)
+        if t.remove(waiter):
+            self.queued_total -= 1
+        waiter.fut.set_exception(self._shed(t, "Deadline cannot be met"))
+        return True
+
+    def _track_deadline(self, t: _Tenant, waiter: _Waiter) -> None:
+        if waiter.deadline is None:
+            return
+        heapq.heappush(self._deadlines, (waiter.deadline, next(self._seq), t, waiter))
+        # Entries of granted or cancelled waiters are dropped lazily; compact
+        # when they dominate
+        if len(self._deadlines) > 2 * self.queued_total + 64:
+            self._deadlines = [e for e in self._deadlines if not e[3].fut.done()]
+            heapq.heapify(self._deadlines)
+
+    async def acquire(
+        self,
+        tenant_id: Optional[str],
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> float:
+        """Wait for an execution slot; returns the queue wait in seconds.
+        Raises QuotaExceeded when the tenant is over its rate or queue quota,
+        and Overloaded when the request is shed. ``tenant_id`` None means an
+        unidentified caller: only the global limits apply.
+        """
+        t0 = time.monotonic()
+        self._evict_idle(t0)
+        t = self._tenant(tenant_id)
+        t.last_active = t0
+        self._take_token(t)
+        if (
+            self.running < self.max_concurrency
+            and not self._blocked(t)
+            and not self._has_waiters()
+        ):
+            self._start(t)
+        else:
+            if t.limited and t.queued() >= self.tenant_max_queue:
+                t.rejected += 1
+                raise QuotaExceeded("Tenant queue is full", 1.0)
+            if self._hopeless(deadline, t0):
+                raise self._shed(t, "Deadline cannot be met")
+            if self.queued_total >= self.max_queue and not self._shed_hopeless(t0):
+                raise self._shed(t, "Server is overloaded")
+            prio = self._priority(t, priority)
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), deadline)
+            key = deadline if deadline is not None else math.inf
+            heapq.heappush(t.queues[prio], (key, next(self._seq), waiter))
+            self.queued_total += 1
+            self._track_deadline(t, waiter)
+            self._mark_ready(t, prio)
+            # Slots may be free while only other tenants' quotas block them
+            self._dispatch()
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - t0 - self.est_run_time)
+            fut = waiter.fut
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except BaseException as e:
+                if fut.done() and not fut.cancelled() and fut.exception() is None:
+                    # Slot was granted while we were being cancelled
+                    self.release(tenant_id)
+                elif not fut.done():
+                    fut.cancel()
+                    if t.remove(waiter):
+                        self.queued_total -= 1
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._shed(t, "Deadline cannot be met")
+                raise
+        waited = time.monotonic() - t0
+        t.admitted += 1
+        t.waits_ms.append(waited * 1000.0)
+        t.wait_max_ms = max(t.wait_max_ms, waited * 1000.0)
+        return waited
+
+    def release(self, tenant_id: Optional[str], run_time: Optional[float] = None) -> None:
+        if run_time is not None:
+            self._est = 0.8 * self.est_run_time + 0.2 * min(run_time, self.est_cap)
+            self._est_at = time.monotonic()
+        t = self._tenant(tenant_id)
+        t.in_flight -= 1
+        t.last_active = time.monotonic()
+        self.running -= 1
+        # A tenant at its in-flight limit left the ready heaps; bring it back
+        for prio in PRIORITIES:
+            self._mark_ready(t, prio)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        tenant_id: Optional[str],
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[float]:
+        waited = await self.acquire(tenant_id, priority, deadline)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(tenant_id, time.monotonic() - started)
+
+    def metrics(self, only: Optional[str] = None) -> Dict[str, Any]:
+        """Scheduler counters; ``only`` restricts the per-tenant section."""
+        tenants: Dict[str, Any] = {}
+        known = dict(self._tenants)
+        known[UNIDENTIFIED] = self._unidentified
+        for tid, t in known.items():
+            if only is not None and tid != only:
+                continue
+            samples: List[float] = sorted(t.waits_ms)
+            tenants[tid] = {
+                "in_flight": t.in_flight,
+                "queued": t.queued(),
+                "admitted": t.admitted,
+                "rejected": t.rejected,
+                "shed": t.shed,
+                "weight": t.weight,
+                "queue_wait_ms": {
+                    "p50": _percentile(samples, 0.50),
+                    "p95": _percentile(samples, 0.95),
+                    "p99": _percentile(samples, 0.99),
+                    "max": round(t.wait_max_ms, 3),
+                },
+            }
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued_total,
+            "max_queue": self.max_queue,
+            "shed": self.shed_total,
+            "est_run_ms": round(self.est_run_time * 1000.0, 3),
+            "tenant_count": len(self._tenants),
+            "tenants": tenants,
+        }
+
+
+def _percentile(sorted_samples: List[float], q: float) -> Optional[float]:
+    if not sorted_samples:
+        return None
+    idx = min(len(sorted_samples) - 1, int(q * len(sorted_samples)))
+    return round(sorted_samples[idx], 3)
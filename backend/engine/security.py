@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional, Tuple
+
+_HASH_ALGO = "pbkdf2_sha256"
+_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "600000"))
+
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "3600"))
+# Webhook tokens are long-lived, bound to one flow and revocable
+WEBHOOK_TOKEN_TTL_SECONDS = int(os.getenv("WEBHOOK_TOKEN_TTL_SECONDS", str(365 * 86400)))
+WEBHOOK_SCOPE = "webhook"
+
+_secret: Optional[bytes] = None
+
+
+class TokenError(Exception):
+    pass
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with salted PBKDF2-SHA256.
+
+    Deliberately slow (CPU-bound): call it off the event loop.
+    """
+    salt = secrets.token_bytes(16)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, _HASH_ITERATIONS)
+    return "$".join(
+        [_HASH_ALGO, str(_HASH_ITERATIONS), _b64encode(salt), _b64encode(dk)]
+    )
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    """Check a password against a stored hash.
+
+    Returns (ok, needs_rehash). Rows created before hashing was introduced
+    hold the plaintext password; they verify once and ask for a rehash.
+    """
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != _HASH_ALGO:
+        ok = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return ok, ok
+    iterations = int(parts[1])
+    dk = hashlib.pbkdf2_hmac(
+        "sha256", password.encode("utf-8"), _b64decode(parts[2]), iterations
+    )
+    ok = hmac.compare_digest(dk, _b64decode(parts[3]))
+    return ok, ok and iterations < _HASH_ITERATIONS
+
+
+def create_access_token(
+    subject: str,
+    role: Optional[str] = None,
+    ttl: int = ACCESS_TOKEN_TTL_SECONDS,
+    extra: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Return a signed HS256 JWT carrying sub, role, iat and exp."""
+    now = int(time.time())
+    header = {"alg": "HS256", "typ": "JWT"}
+    claims: Dict[str, Any] = {"sub": str(subject), "iat": now, "exp": now + ttl}
+    if role:
+        claims["role"] = role
+    if extra:
+        claims.update(extra)
+    signing_input = (
+        _b64encode(json.dumps(header, separators=(",", ":")).encode("utf-8"))
+        + "."
+        + _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    )
+    return signing_input + "." + _b64encode(_sign(signing_input))
+
+
+def create_webhook_token(
+    subject: str, flow_id: int, ttl: int = WEBHOOK_TOKEN_TTL_SECONDS
+) -> Tuple[str, str]:
+    """Return (token, jti) for a webhook sender of one flow.
+    The token carries scope=webhook and flow_id; it is accepted only by
+    /run-flow/db for that flow, and revoked by its jti.
+    """
+    jti = secrets.token_urlsafe(16)
+    token = create_access_token(
+        subject, ttl=ttl, extra={"scope": WEBHOOK_SCOPE, "flow_id": int(flow_id), "jti": jti}
+    )
+    return token, jti
+
+
+def verify_access_token(token: str) -> Dict[str, Any]:
+    """Verify signature and expiry in memory and return the claims."""
+    try:
+        header_b64, claims_b64, sig_b64 = token.split(".")
+    except ValueError:
+        raise TokenError("Malformed token")
+    expected = _sign(header_b64 + "." + claims_b64)
+    try:
+        given = _b64decode(sig_b64)
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+    except Exception:
+        raise TokenError("Malformed token")
+    if not hmac.compare_digest(expected, given) or header.get("alg") != "HS256":
+        raise TokenError("Invalid token signature")
+    if int(claims.get("exp", 0)) <= int(time.time()):
+        raise TokenError("Token expired")
+    return claims
+
+
+def auth_dev_mode() -> bool:
+    return os.getenv("AUTH_DEV_MODE", "false").lower() in ("1", "true", "yes")
+
+
+def _secret_key() -> bytes:
+    # Read lazily so AUTH_SECRET from .env (loaded by main.py) is honoured
+    global _secret
+    if _secret is None:
+        env = os.getenv("AUTH_SECRET")
+        if not env:
+            if not auth_dev_mode():
+                # A per-process random key would make tokens fail across
+                # uvicorn workers and restarts
+                raise RuntimeError("AUTH_SECRET is not set (set AUTH_DEV_MODE=true for local development)")
+            print("[warn] AUTH_DEV_MODE: using a random AUTH_SECRET, tokens will not survive restarts.")
+        _secret = (env or secrets.token_urlsafe(32)).encode("utf-8")
+    return _secret
+
+
+def check_secret() -> None:
+    """Fail fast at startup when tokens could not be signed consistently."""
+    _secret_key()
+
+
+def sign_blob_id(blob_id: str) -> str:
+    """Signature that grants read access to one blob via its URL."""
+    return _b64encode(_sign("blob:" + blob_id))
+
+
+def verify_blob_signature(blob_id: str, sig: Optional[str]) -> bool:
+    return hmac.compare_digest(
+        sign_blob_id(blob_id).encode("ascii"), (sig or "").encode("utf-8")
+    )
+
+
+def _sign(signing_input: str) -> bytes:
+    return hmac.new(_secret_key(), signing_input.encode("ascii"), hashlib.sha256).digest()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
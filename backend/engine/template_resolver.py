@@ -1,18 +1,25 @@
 from __future__ import annotations
 
 import re
+from collections.abc import Mapping
 from typing import Any, Dict
 
+from .blob_store import blob_store, is_blob_ref
+
 TOKEN_RE = re.compile(r"\{\{\s*([^}]+?)\s*\}\}")
 
 
 def _get_by_path(root: Any, path: str) -> Any:
     """Resolve dotted path like 'nodes.chat_1.generated_response.subject'.
-    Supports integer indices for lists like 'items.0.id'.
+    Supports integer indices for lists like 'items.0.id'. Any Mapping is
+    traversed, so layered states (collections.ChainMap) resolve too. Values
+    spilled to the blob store are loaded only when a path reaches them.
     Returns None if not found.
     """
     cur = root
     for part in path.split("."):
+        if is_blob_ref(cur):
+            cur = blob_store.load(cur)
         if isinstance(cur, list):
             try:
                 idx = int(part)
@@ -21,12 +28,14 @@ def _get_by_path(root: Any, path: str) -> Any:
             if idx < 0 or idx >= len(cur):
                 return None
             cur = cur[idx]
-        elif isinstance(cur, dict):
+        elif isinstance(cur, Mapping):
             if part not in cur:
                 return None
             cur = cur[part]
         else:
             return None
+    if is_blob_ref(cur):
+        cur = blob_store.load(cur)
     return cur
 
 
@@ -39,6 +48,23 @@ def _replace_in_string(s: str, state: Dict[str, Any]) -> str:
     return TOKEN_RE.sub(repl, s)
 
 
+def resolve_value(expr: Any, state: Dict[str, Any]) -> Any:
+    """Resolve a single reference to the referenced object itself.
+
+    Unlike resolve_templates, which renders placeholders into strings, this
+    returns the raw value (list, dict, number...). Accepts '{{path}}' or a
+    bare dotted 'path'; non-string values are returned unchanged.
+    """
+    if not isinstance(expr, str):
+        return expr
+    m = TOKEN_RE.fullmatch(expr.strip())
+    if m:
+        return _get_by_path(state, m.group(1).strip())
+    if "{{" in expr:
+        return _replace_in_string(expr, state)
+    return _get_by_path(state, expr.strip())
+
+
 def resolve_templates(obj: Any, state: Dict[str, Any]) -> Any:
     """Recursively resolve {{ ... }} placeholders within a JSON-like config object.
 
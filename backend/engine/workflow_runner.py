@@ -1,18 +1,42 @@
 from __future__ import annotations
 
+import contextvars
 import copy
 import datetime
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, MutableMapping, Optional
 
+from .blob_store import blob_store
+from .executors import run_node
 from .template_resolver import resolve_templates
-from .nodes import NODE_HANDLERS
+from .nodes import NODE_HANDLERS, RAW_CONFIG_KEYS
 
 
 class WorkflowError(Exception):
     pass
 
 
+class WorkflowCancelled(WorkflowError):
+    """Raised between nodes when the caller no longer wants the result.
+    ``completed`` lists the nodes that already ran (and had their effects).
+    """
+
+    def __init__(self, message: str, completed: Optional[List[str]] = None) -> None:
+        super().__init__(message)
+        self.completed = list(completed or [])
+
+
+# Stop callback of the workflow being executed, for nodes that run sub-graphs
+_should_stop: contextvars.ContextVar[Optional[Callable[[], bool]]] = contextvars.ContextVar(
+    "should_stop", default=None
+)
+
+
+def current_should_stop() -> Optional[Callable[[], bool]]:
+    """Return the stop callback of the enclosing execute_workflow call."""
+    return _should_stop.get()
+
+
 def _index_nodes(nodes: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
     by_id = {}
     for n in nodes:
@@ -68,28 +92,62 @@ def _find_entry_node(
     return next(iter(nodes_by_id.keys()))
 
 
+# Sentinel keys in the per-source edge index
+_UNPORTED = ""
+_FIRST = None
+
+
+def _index_edges(
+    edges: List[Dict[str, Any]]
+) -> Dict[str, Dict[Optional[str], str]]:
+    """Map source -> {port: target}, keeping the first edge per port.
+    Edges without a source_port are stored under _UNPORTED and the first
+    outgoing edge of each source under _FIRST.
+    """
+    index: Dict[str, Dict[Optional[str], str]] = {}
+    for e in edges:
+        by_port = index.setdefault(e.get("source"), {})
+        by_port.setdefault(_FIRST, e.get("target"))
+        by_port.setdefault(e.get("source_port") or _UNPORTED, e.get("target"))
+    return index
+
+
 def _choose_next(
-    edges: List[Dict[str, Any]], current_id: str, port: Optional[str] = None
+    edge_index: Dict[str, Dict[Optional[str], str]],
+    current_id: str,
+    port: Optional[str] = None,
+    default_port: Optional[str] = None,
 ) -> Optional[str]:
-    """Choose the next node, considering optional source_port routing."""
-    outgoing = [e for e in edges if e.get("source") == current_id]
-    if not outgoing:
+    """Choose the next node, considering optional source_port routing.
+    An unwired named port falls back to the "default" port. Nodes that name
+    their own ``default_port`` (logic.switch) route only to the chosen port
+    or that default; when neither is wired the path ends.
+    """
+    by_port = edge_index.get(current_id)
+    if not by_port:
         return None
-    if port is not None:
-        for e in outgoing:
-            if e.get("source_port") == port:
-                return e.get("target")
+    if default_port is not None:
+        return by_port.get(port or default_port) or by_port.get(default_port)
+    if port:
+        target = by_port.get(port)
+        if target is not None:
+            return target
+        # unwired named port: use the default port
+        target = by_port.get("default")
+        if target is not None:
+            return target
     # fallback: an edge without explicit source_port, else first
-    for e in outgoing:
-        if not e.get("source_port"):
-            return e.get("target")
-    return outgoing[0].get("target")
+    target = by_port.get(_UNPORTED)
+    if target is not None:
+        return target
+    return by_port.get(_FIRST)
 
 
 def run_workflow(
     workflow: Dict[str, Any],
     initial_state: Optional[Dict[str, Any]] = None,
     webhook_payload: Optional[Dict[str, Any]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
 ) -> Dict[str, Any]:
     """
     Execute a workflow defined by nodes and edges.
@@ -110,7 +168,45 @@ def run_workflow(
       ],
       "entry": "trigger_1"  # optional
     }
+
+    ``should_stop`` is polled before each node; when it returns True the run
+    is abandoned with WorkflowCancelled (e.g. the client disconnected).
+    """
+    state: Dict[str, Any] = {
+        "nodes": {},  # node_id -> outputs
+        # Large payload fields are kept on disk and referenced
+        "payload": blob_store.spill_fields(webhook_payload or {}, keep=()),
+    }
+    if initial_state:
+        # copy to avoid caller mutation
+        state.update(copy.deepcopy(initial_state))
+    return execute_workflow(workflow, state, should_stop)
+
+
+def execute_workflow(
+    workflow: Dict[str, Any],
+    state: MutableMapping[str, Any],
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> MutableMapping[str, Any]:
+    """Run ``workflow`` against an existing ``state`` and return it.
+
+    Node outputs are written to ``state["nodes"]`` and ``trace``/``logs`` are
+    set on ``state``. Used by run_workflow and by nodes that run sub-graphs
+    (e.g. logic.for_each) on a layered per-item state; those pass
+    current_should_stop() on so sub-graphs stop with their parent.
     """
+    token = _should_stop.set(should_stop)
+    try:
+        return _execute(workflow, state, should_stop)
+    finally:
+        _should_stop.reset(token)
+
+
+def _execute(
+    workflow: Dict[str, Any],
+    state: MutableMapping[str, Any],
+    should_stop: Optional[Callable[[], bool]],
+) -> MutableMapping[str, Any]:
     nodes: List[Dict[str, Any]] = workflow.get("nodes", [])
     edges: List[Dict[str, Any]] = workflow.get("edges", [])
 
@@ -118,27 +214,30 @@ def run_workflow(
         raise WorkflowError("Workflow has no nodes")
 
     nodes_by_id = _index_nodes(nodes)
+    edge_index = _index_edges(edges)
     current_id = _find_entry_node(workflow, nodes_by_id)
 
-    state: Dict[str, Any] = {
-        "nodes": {},  # node_id -> outputs
-        "payload": webhook_payload or {},
-    }
-    if initial_state:
-        # copy to avoid caller mutation
-        state.update(copy.deepcopy(initial_state))
-
     trace: List[str] = []
     logs: List[Dict[str, Any]] = []
 
     while current_id:
+        if should_stop is not None and should_stop():
+            raise WorkflowCancelled(f"Run cancelled before node '{current_id}'", trace)
         trace.append(current_id)
         node = nodes_by_id[current_id]
         node_type = node.get("type")
         config = node.get("config", {})
 
-        # Resolve templates in config before execution
-        resolved_config = resolve_templates(config, state)
+        # Resolve templates in config before execution; raw keys (sub-graphs,
+        # list references) are left for the handler to interpret
+        raw_keys = RAW_CONFIG_KEYS.get(str(node_type), ())
+        if raw_keys:
+            resolved_config = resolve_templates(
+                {k: v for k, v in config.items() if k not in raw_keys}, state
+            )
+            resolved_config.update({k: config[k] for k in raw_keys if k in config})
+        else:
+            resolved_config = resolve_templates(config, state)
 
         handler = NODE_HANDLERS.get(str(node_type))
         if not handler:
@@ -149,15 +248,23 @@ def run_workflow(
         status = "success"
         err_msg: Optional[str] = None
         try:
+            # Handlers run inline, in a thread or in a worker process
+            # depending on the node type's "execution" in nodes_config.yml
             outputs = (
-                handler(state=state, config=resolved_config, node_id=current_id) or {}
+                run_node(str(node_type), handler, state, resolved_config, current_id)
+                or {}
             )
+        except WorkflowCancelled as e:
+            # A sub-graph was stopped; the whole run is cancelled
+            raise WorkflowCancelled(str(e), trace)
         except Exception as e:
             status = "error"
             err_msg = str(e)
             outputs = {"error": err_msg}
 
-        # Store outputs for downstream referencing
+        # Store outputs for downstream referencing; large fields are spilled
+        # to the blob store so state, logs and the response share one ref
+        outputs = blob_store.spill_fields(outputs)
         state["nodes"][current_id] = outputs
 
         elapsed_ms = int((time.perf_counter() - t0) * 1000)
@@ -182,7 +289,15 @@ def run_workflow(
             next_id = outputs.get("next")
         if not next_id:
             port = outputs.get("port") if isinstance(outputs, dict) else None
-            next_id = _choose_next(edges, current_id, port)
+            default_port = (
+                outputs.get("default_port") if isinstance(outputs, dict) else None
+            )
+            next_id = _choose_next(
+                edge_index,
+                current_id,
+                port,
+                str(default_port) if default_port is not None else None,
+            )
 
         if status == "error" or not next_id or node_type == "logic.end":
             break
@@ -4,15 +4,19 @@ from typing import Any, Dict
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import yaml
-
-from router.flows_api import flows_router
-from router.auth_api import auth_router
-from engine.db import init_db
-
 
+# Load .env before importing modules that read their settings at import time
 load_dotenv()
 
+from router.flows_api import flows_router  # noqa: E402
+from router.auth_api import auth_router  # noqa: E402
+from engine.blob_store import blob_store  # noqa: E402
+from engine.db import init_db  # noqa: E402
+from engine.security import check_secret  # noqa: E402
+from engine.executors import process_pool  # noqa: E402
+from engine.nodes import execution_for, load_nodes_config, NODE_HANDLERS  # noqa: E402
+from engine.provider_mocks import install_mocks, latency_from_env  # noqa: E402
+
 app = FastAPI(title="Mini n8n-like Workflow Engine", version="0.1.0")
 
 # Allow local dev UI to access the API
@@ -33,11 +37,44 @@ app.include_router(flows_router)
 app.include_router(auth_router)
 
 
+@app.on_event("startup")
+def startup_check_secret() -> None:
+    check_secret()
+
+
 @app.on_event("startup")
 def startup_init_db() -> None:
     init_db()
 
 
+@app.on_event("startup")
+def startup_provider_mocks() -> None:
+    # Load testing only: replace chat/SMS/email providers with local mocks
+    latency = latency_from_env()
+    if latency is not None:
+        install_mocks(latency)
+        print(f"[warn] PROVIDER_MOCKS is set: provider nodes are mocked ({os.getenv('PROVIDER_MOCKS')})")
+
+
+@app.on_event("startup")
+def startup_purge_blobs() -> None:
+    removed = blob_store.purge(blob_store.ttl_seconds)
+    if removed:
+        print(f"[info] Purged {removed} expired blobs")
+
+
+@app.on_event("startup")
+def startup_process_pool() -> None:
+    # Warm the worker processes up front when any node type needs them
+    if any(execution_for(t)[0] == "process" for t in NODE_HANDLERS):
+        process_pool.start()
+
+
+@app.on_event("shutdown")
+def shutdown_process_pool() -> None:
+    process_pool.shutdown()
+
+
 @app.get("/")
 def health() -> Dict[str, str]:
     return {"status": "ok", "docs": "/docs"}
@@ -46,11 +83,8 @@ def health() -> Dict[str, str]:
 @app.get("/nodes")
 def get_nodes_config() -> Dict[str, Any]:
     """Return available nodes configuration from YAML."""
-    config_path = os.path.join(os.path.dirname(
-        __file__), "engine", "nodes_config.yml")
-    if not os.path.exists(config_path):
+    try:
+        return load_nodes_config()
+    except FileNotFoundError:
         raise HTTPException(
             status_code=500, detail="nodes_config.yml not found")
-    with open(config_path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f)
-    return data
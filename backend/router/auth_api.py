@@ -1,13 +1,49 @@
-from typing import Any, Dict
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
-from engine.db import db_create_user, db_get_user_by_email
+from engine.db import (
+    db_create_user,
+    db_create_webhook_token,
+    db_get_flow,
+    db_get_user_by_email,
+    db_list_revoked_webhook_jtis,
+    db_list_webhook_tokens,
+    db_revoke_webhook_token,
+    db_update_user_password,
+)
+from engine.security import (
+    ACCESS_TOKEN_TTL_SECONDS,
+    WEBHOOK_SCOPE,
+    WEBHOOK_TOKEN_TTL_SECONDS,
+    TokenError,
+    create_access_token,
+    create_webhook_token,
+    hash_password,
+    verify_access_token,
+    verify_password,
+)
 
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
 
+# Password hashing is deliberately expensive. It gets its own small pool so a
+# login burst queues here instead of occupying the threadpool that runs flows.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    thread_name_prefix="password-hash",
+)
+
+# Compared against when the email is unknown, so both paths cost the same
+_DUMMY_HASH = hash_password("flowart-dummy-password")
+
 
 class SignupRequest(BaseModel):
     email: str
@@ -19,20 +55,207 @@ class LoginRequest(BaseModel):
     password: str
 
 
+class WebhookTokenRequest(BaseModel):
+    flow_id: int
+    ttl_seconds: Optional[int] = None
+
+
+class _RevokedWebhookTokens:
+    """In-memory set of revoked webhook token ids, reloaded from the DB at
+    most every ``refresh_seconds`` so verifying a token is not a DB query.
+    """
+
+    def __init__(self, refresh_seconds: float) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._jtis: Set[str] = set()
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._loaded_at < self.refresh_seconds:
+                return
+            self._loaded_at = now
+        try:
+            jtis = set(db_list_revoked_webhook_jtis())
+        except Exception as e:
+            print(f"[warn] Could not reload revoked webhook tokens: {e}")
+            return
+        with self._lock:
+            self._jtis = jtis
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            self._jtis.add(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        self._refresh()
+        return not jti or jti in self._jtis
+
+
+_revoked_webhook_tokens = _RevokedWebhookTokens(
+    float(os.getenv("WEBHOOK_REVOCATION_REFRESH_SECONDS", "30"))
+)
+
+
+async def _in_hash_pool(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, fn, *args)
+
+
+def _auth_required() -> bool:
+    return os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "yes")
+
+
+def _bearer_claims(authorization: str) -> Dict[str, Any]:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    try:
+        return verify_access_token(token.strip())
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
+def get_current_user(
+    authorization: Optional[str] = Header(None),
+) -> Optional[Dict[str, Any]]:
+    """Verify a 'Bearer' access token without touching the DB.
+
+    Returns the token claims, or None when no token was sent and
+    AUTH_REQUIRED is off. Webhook tokens are not accepted here.
+    """
+    if not authorization:
+        if _auth_required():
+            raise HTTPException(status_code=401, detail="Missing access token")
+        return None
+    claims = _bearer_claims(authorization)
+    if claims.get("scope") == WEBHOOK_SCOPE:
+        raise HTTPException(status_code=401, detail="Webhook tokens are only valid for /run-flow/db")
+    return claims
+
+
+def require_user(
+    claims: Optional[Dict[str, Any]] = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """Like get_current_user, but a token is mandatory regardless of AUTH_REQUIRED."""
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Missing access token")
+    return claims
+
+
+def require_run_credential(
+    authorization: Optional[str] = Header(None),
+) -> Dict[str, Any]:
+    """Accept a user access token or an unrevoked webhook token.
+    Webhook token claims carry ``flow_id``; callers must check it.
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing access token")
+    claims = _bearer_claims(authorization)
+    if claims.get("scope") == WEBHOOK_SCOPE and _revoked_webhook_tokens.is_revoked(
+        claims.get("jti")
+    ):
+        raise HTTPException(status_code=401, detail="Webhook token revoked")
+    return claims
+
+
+def resolve_user_id(
+    claims: Optional[Dict[str, Any]], requested: Optional[Any]
+) -> Optional[str]:
+    """Return the caller's user id, preferring the token subject.
+    A requested user id that differs from the token subject is rejected.
+    """
+    if claims is None:
+        return str(requested) if requested else None
+    sub = str(claims.get("sub"))
+    if requested and str(requested) != sub:
+        raise HTTPException(status_code=403, detail="User not permitted")
+    return sub
+
+
+def _token_response(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": user.get("id"),
+        "email": user.get("email"),
+        "role": user.get("role"),
+        "access_token": create_access_token(str(user.get("id")), user.get("role")),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS,
+    }
+
+
 @auth_router.post("/signup")
-def signup(req: SignupRequest) -> Dict[str, Any]:
-    existing = db_get_user_by_email(req.email)
+async def signup(req: SignupRequest) -> Dict[str, Any]:
+    existing = await run_in_threadpool(db_get_user_by_email, req.email)
     if existing is not None:
         raise HTTPException(status_code=400, detail="User already exists")
-    user_id = db_create_user(req.email, req.password)
-    user = db_get_user_by_email(req.email)
+    hashed = await _in_hash_pool(hash_password, req.password)
+    user_id = await run_in_threadpool(db_create_user, req.email, hashed)
+    user = await run_in_threadpool(db_get_user_by_email, req.email)
     role = user.get("role") if user is not None else "user"
-    return {"id": user_id, "email": req.email, "role": role}
+    return _token_response({"id": user_id, "email": req.email, "role": role})
 
 
 @auth_router.post("/login")
-def login(req: LoginRequest) -> Dict[str, Any]:
-    user = db_get_user_by_email(req.email)
-    if user is None or user.get("password") != req.password:
+async def login(req: LoginRequest) -> Dict[str, Any]:
+    user = await run_in_threadpool(db_get_user_by_email, req.email)
+    stored = user.get("password") if user is not None else _DUMMY_HASH
+    ok, needs_rehash = await _in_hash_pool(verify_password, req.password, stored)
+    if user is None or not ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
-    return {"id": user.get("id"), "email": user.get("email"), "role": user.get("role")}
+    if needs_rehash:
+        hashed = await _in_hash_pool(hash_password, req.password)
+        await run_in_threadpool(db_update_user_password, user.get("id"), hashed)
+    return _token_response(user)
+
+
+@auth_router.post("/webhook-tokens")
+async def create_webhook_token_for_flow(
+    req: WebhookTokenRequest, claims: Dict[str, Any] = Depends(require_user)
+) -> Dict[str, Any]:
+    """Issue a long-lived token that can only run one of the caller's flows."""
+    user_id = str(claims.get("sub"))
+    flow = await run_in_threadpool(db_get_flow, req.flow_id)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    if str(flow.get("user_id")) != user_id:
+        raise HTTPException(status_code=403, detail="User not permitted for this flow")
+    ttl = req.ttl_seconds or WEBHOOK_TOKEN_TTL_SECONDS
+    if ttl <= 0 or ttl > WEBHOOK_TOKEN_TTL_SECONDS:
+        raise HTTPException(
+            status_code=400, detail=f"ttl_seconds must be 1..{WEBHOOK_TOKEN_TTL_SECONDS}"
+        )
+    token, jti = create_webhook_token(user_id, req.flow_id, ttl)
+    await run_in_threadpool(db_create_webhook_token, jti, user_id, req.flow_id, ttl)
+    return {
+        "webhook_token": token,
+        "jti": jti,
+        "flow_id": req.flow_id,
+        "token_type": "bearer",
+        "expires_in": ttl,
+    }
+
+
+@auth_router.get("/webhook-tokens")
+async def list_webhook_tokens(
+    claims: Dict[str, Any] = Depends(require_user),
+) -> Dict[str, List[Dict[str, Any]]]:
+    """List the caller's webhook tokens (metadata only, never the tokens)."""
+    items = await run_in_threadpool(db_list_webhook_tokens, str(claims.get("sub")))
+    return {"items": items}
+
+
+@auth_router.delete("/webhook-tokens/{jti}")
+async def revoke_webhook_token(
+    jti: str, claims: Dict[str, Any] = Depends(require_user)
+) -> Dict[str, Any]:
+    """Revoke a webhook token. Other workers pick it up within
+    WEBHOOK_REVOCATION_REFRESH_SECONDS.
+    """
+    found = await run_in_threadpool(db_revoke_webhook_token, jti, str(claims.get("sub")))
+    if not found:
+        raise HTTPException(status_code=404, detail="Webhook token not found")
+    _revoked_webhook_tokens.add(jti)
+    return {"jti": jti, "revoked": True}
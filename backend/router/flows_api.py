@@ -1,10 +1,28 @@
-import json
+import asyncio
 import os
-from typing import Any, Dict, List, Optional
-from fastapi import APIRouter
-from engine.workflow_runner import run_workflow
-from engine.db import init_db, db_get_flow, db_save_flow
-from fastapi.responses import JSONResponse
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from engine.workflow_runner import WorkflowCancelled, run_workflow
+from engine.db import (
+    init_db,
+    db_get_flow,
+    db_list_flow_versions,
+    db_list_flows,
+    db_save_flow,
+)
+from engine.blob_store import blob_store
+from engine.flow_index import FlowIndex
+from engine.flow_versions import canonical_json, content_hash
+from engine.idempotency import IdempotencyConflict, IdempotencyStore, derive_key, fingerprint
+from engine.scheduler import UNIDENTIFIED, QuotaExceeded, TenantScheduler
+from engine.security import verify_blob_signature
+from router.auth_api import get_current_user, require_run_credential, require_user, resolve_user_id
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi import HTTPException
 from pydantic import BaseModel
 
@@ -13,6 +31,196 @@ flows_router = APIRouter(tags=["flows"])
 
 EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "examples")
 
+# Cached listing/contents of EXAMPLES_DIR, refreshed on mtime changes
+_examples_index = FlowIndex(EXAMPLES_DIR)
+
+# Per-tenant quotas and fair queueing in front of flow execution
+run_scheduler = TenantScheduler.from_env()
+
+# Default time budget for a run (queueing included); 0 disables deadlines.
+# Clients may send X-Request-Timeout-Ms to use their own timeout instead.
+RUN_DEADLINE_MS = int(os.getenv("RUN_DEADLINE_MS", "0"))
+_DISCONNECT_POLL_SECONDS = 0.25
+
+# Status for runs abandoned because the client went away (nginx convention)
+_CLIENT_CLOSED_REQUEST = 499
+
+# First result per idempotency key, so webhook retries do not re-run flows
+idempotency_store = IdempotencyStore.from_env()
+_IDEMPOTENCY_KEY_FIELDS = [
+    f.strip() for f in os.getenv("IDEMPOTENCY_KEY_FIELDS", "").split(",") if f.strip()
+]
+
+
+class _ClientGone(Exception):
+    pass
+
+
+class _Disconnect:
+    """Watch a request for client disconnects while its run is pending.
+
+    ``event`` lets async code race against the disconnect; ``is_set`` is safe
+    to poll from the runner thread between nodes.
+    """
+
+    def __init__(self, request: Request) -> None:
+        self.request = request
+        self.event = asyncio.Event()
+        self._flag = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def is_set(self) -> bool:
+        return self._flag.is_set()
+
+    async def _watch(self) -> None:
+        while not await self.request.is_disconnected():
+            await asyncio.sleep(_DISCONNECT_POLL_SECONDS)
+        self._flag.set()
+        self.event.set()
+
+    async def __aenter__(self) -> "_Disconnect":
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _deadline(timeout_ms: Optional[int]) -> Optional[float]:
+    ms = timeout_ms if timeout_ms is not None else RUN_DEADLINE_MS
+    if not ms or ms <= 0:
+        return None
+    return time.monotonic() + ms / 1000.0
+
+
+@asynccontextmanager
+async def _run_slot(
+    tenant_id: Optional[str],
+    priority: Optional[str] = None,
+    deadline: Optional[float] = None,
+    disconnect: Optional[_Disconnect] = None,
+):
+    """Hold a scheduler slot for a run.
+    Over-quota callers get a 429 and shed requests a 503, both with
+    Retry-After; a client that disconnects while queued gives up its place.
+    """
+    acquire = asyncio.ensure_future(run_scheduler.acquire(tenant_id, priority, deadline))
+    try:
+        if disconnect is not None and not acquire.done():
+            gone = asyncio.ensure_future(disconnect.event.wait())
+            try:
+                await asyncio.wait({acquire, gone}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                gone.cancel()
+            if not acquire.done():
+                acquire.cancel()
+                try:
+                    await acquire
+                except asyncio.CancelledError:
+                    pass
+                raise _ClientGone()
+        await acquire
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))},
+        )
+    except asyncio.CancelledError:
+        acquire.cancel()
+        raise
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        run_scheduler.release(tenant_id, time.monotonic() - started)
+
+
+def _idempotency_key(
+    header_key: Optional[str], payload: Dict[str, Any]
+) -> Tuple[Optional[str], bool]:
+    """Return (key, derived): the Idempotency-Key header, else
+    payload.idempotency_key, else a key derived from IDEMPOTENCY_KEY_FIELDS
+    when all of them are in the payload.
+    """
+    key = header_key or payload.get("idempotency_key")
+    if key:
+        return str(key), False
+    return derive_key(payload, _IDEMPOTENCY_KEY_FIELDS), True
+
+
+async def _execute_run(
+    request: Request,
+    tenant_id: Optional[str],
+    flow_scope: Callable[[], str],
+    priority: Optional[str],
+    idempotency_key: Tuple[Optional[str], bool],
+    timeout_ms: Optional[int],
+    workflow: Dict[str, Any],
+    initial_state: Dict[str, Any],
+    payload: Dict[str, Any],
+) -> JSONResponse:
+    """Admit a run through the tenant scheduler and execute it.
+    Duplicate requests with the same idempotency key share the first result
+    and never take a scheduler slot. Keys are scoped by tenant and
+    ``flow_scope()`` (the flow identity, computed only when there is a key).
+    An explicit key reused with a different body is rejected with 422; a
+    key derived from payload fields is not, since retries of the same event
+    may differ in other fields (attempt counters, timestamps). Runs stop between nodes once the client
+    disconnects (499) or the deadline passes (504).
+    """
+    deadline = _deadline(timeout_ms)
+
+    async def _run() -> Dict[str, Any]:
+        async with _Disconnect(request) as disconnect:
+            async with _run_slot(tenant_id, priority, deadline, disconnect):
+
+                def should_stop() -> bool:
+                    return disconnect.is_set() or (
+                        deadline is not None and time.monotonic() > deadline
+                    )
+
+                try:
+                    return await run_in_threadpool(
+                        run_workflow,
+                        workflow=workflow,
+                        initial_state=initial_state,
+                        webhook_payload=payload,
+                        should_stop=should_stop,
+                    )
+                except WorkflowCancelled as e:
+                    if disconnect.is_set():
+                        raise _ClientGone()
+                    # Nodes before the stop ran, side effects included; say which
+                    completed = ", ".join(e.completed) or "none"
+                    raise HTTPException(
+                        status_code=504, detail=f"{e} (completed nodes: {completed})"
+                    )
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+
+    raw_key, derived = idempotency_key
+    try:
+        if not raw_key:
+            return JSONResponse(content=await _run())
+        key = IdempotencyStore.scoped_key(tenant_id or "anonymous", flow_scope(), raw_key)
+        result, replayed = await idempotency_store.run(
+            key,
+            _run,
+            abandon=(_ClientGone,),
+            fp=None if derived else fingerprint(payload, initial_state),
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except _ClientGone:
+        print(f"[ RUN ] Client disconnected; run for tenant '{tenant_id or UNIDENTIFIED}' abandoned.")
+        raise HTTPException(status_code=_CLIENT_CLOSED_REQUEST, detail="Client disconnected")
+    return JSONResponse(
+        content=result,
+        headers={"Idempotent-Replayed": "true" if replayed else "false"},
+    )
+
 
 def _ensure_examples_dir():
     os.makedirs(EXAMPLES_DIR, exist_ok=True)
@@ -38,6 +246,7 @@ class RunRequest(BaseModel):
     workflow: Dict[str, Any]
     payload: Optional[Dict[str, Any]] = None
     initial_state: Optional[Dict[str, Any]] = None
+    priority: Optional[str] = None
 
 
 class SaveFlowRequest(BaseModel):
@@ -47,69 +256,162 @@ class SaveFlowRequest(BaseModel):
 class RunFlowDBRequest(BaseModel):
     payload: Optional[Dict[str, Any]] = None
     initial_state: Optional[Dict[str, Any]] = None
+    priority: Optional[str] = None
 
 
 @flows_router.post("/run-flow")
-def run_flow(req: RunRequest):
-    try:
-        # with open("examples/flow_basic.json", "r") as f:
-        #    workflow = json.load(f)
-        result = run_workflow(
-            workflow=req.workflow,
-            initial_state=req.initial_state or {},
-            webhook_payload=req.payload or {},
-        )
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+async def run_flow(
+    req: RunRequest,
+    request: Request,
+    claims: Optional[Dict[str, Any]] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
+    x_request_timeout_ms: Optional[int] = Header(None),
+):
+    # Unauthenticated callers are only bound by the global limits
+    tenant_id = resolve_user_id(claims, None)
+    payload = req.payload or {}
+    return await _execute_run(
+        request,
+        tenant_id,
+        lambda: "workflow:" + content_hash(canonical_json(req.workflow)),
+        req.priority,
+        _idempotency_key(idempotency_key, payload),
+        x_request_timeout_ms,
+        workflow=req.workflow,
+        initial_state=req.initial_state or {},
+        payload=payload,
+    )
 
 
 @flows_router.post("/run-flow/db")
-def run_flow_db(req: RunFlowDBRequest):
-    """Run a saved flow by extracting user_id and flow_id from the payload."""
+async def run_flow_db(
+    req: RunFlowDBRequest,
+    request: Request,
+    claims: Dict[str, Any] = Depends(require_run_credential),
+    idempotency_key: Optional[str] = Header(None),
+    x_request_timeout_ms: Optional[int] = Header(None),
+):
+    """Run a saved flow by extracting flow_id from the payload.
+    An optional payload.flow_version pins the run to that version.
+    An access token or a webhook token for this flow is required; the
+    caller's identity comes from it and payload.user_id, if given, must
+    match. Runs are admitted per user by the tenant scheduler.
+    """
     # Ensure DB is initialized (no-op if already done)
     try:
-        init_db()
+        await run_in_threadpool(init_db)
     except Exception:
         pass
 
     payload = req.payload or {}
-    user_id = payload.get("user_id")
+    user_id = resolve_user_id(claims, payload.get("user_id"))
     flow_id = payload.get("flow_id")
-    if not user_id or not flow_id:
-        raise HTTPException(
-            status_code=400, detail="payload.user_id and payload.flow_id are required"
-        )
+    if not flow_id:
+        raise HTTPException(status_code=400, detail="payload.flow_id is required")
+    if claims.get("flow_id") is not None and int(claims["flow_id"]) != int(flow_id):
+        raise HTTPException(status_code=403, detail="Webhook token is not valid for this flow")
 
-    item = db_get_flow(int(flow_id))
+    flow_version = payload.get("flow_version")
+    item = await run_in_threadpool(
+        db_get_flow,
+        int(flow_id),
+        int(flow_version) if flow_version is not None else None,
+    )
     if not item:
         raise HTTPException(status_code=404, detail="Flow not found")
     if str(item.get("user_id")) != str(user_id):
         raise HTTPException(status_code=403, detail="User not permitted for this flow")
 
-    try:
-        result = run_workflow(
-            workflow=item.get("workflow") or {},
-            initial_state=req.initial_state or {},
-            webhook_payload=payload,
-        )
-        return JSONResponse(content=result)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    return await _execute_run(
+        request,
+        str(user_id),
+        lambda: f"flow:{int(flow_id)}@{item.get('version')}",
+        req.priority,
+        _idempotency_key(idempotency_key, payload),
+        x_request_timeout_ms,
+        workflow=item.get("workflow") or {},
+        initial_state=req.initial_state or {},
+        payload=payload,
+    )
+
+
+@flows_router.get("/metrics/tenants")
+async def tenant_metrics(claims: Dict[str, Any] = Depends(require_user)) -> Dict[str, Any]:
+    """Per-tenant scheduler counters and queue-wait percentiles.
+    Admins see every tenant; other users only their own entry.
+    """
+    if claims.get("role") == "admin":
+        return run_scheduler.metrics()
+    return run_scheduler.metrics(only=str(claims.get("sub")))
 
 
-@flows_router.get("/flows")
+@flows_router.get("/blobs/{blob_id}", dependencies=[Depends(get_current_user)])
+def get_blob(blob_id: str, sig: Optional[str] = None):
+    """Stream a large node output or payload field referenced as {"$blob": id}.
+    The signed ``url`` of the reference is required; a bare id is not enough.
+    """
+    path = blob_store.path_for(blob_id)
+    if path is None or not verify_blob_signature(blob_id, sig):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    media_type = "application/json" if path.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type)
+
+
+@flows_router.get("/flows", dependencies=[Depends(get_current_user)])
 def list_flows() -> Dict[str, Any]:
     """List available flows in the examples directory."""
     _ensure_examples_dir()
-    items: List[str] = []
-    for fname in sorted(os.listdir(EXAMPLES_DIR)):
-        if fname.endswith(".json"):
-            items.append(fname)
-    return {"flows": items}
+    return {"flows": _examples_index.list_names()}
+
+
+@flows_router.get("/db/flows")
+def list_db_flows(
+    user_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    claims: Dict[str, Any] = Depends(require_user),
+) -> Dict[str, Any]:
+    """List a user's flows stored in the DB, newest first.
+    Pass the returned next_cursor back as 'cursor' to fetch the next page.
+    """
+    user_id = resolve_user_id(claims, user_id)
+    try:
+        init_db()
+    except Exception:
+        pass
+    rows = db_list_flows(
+        user_id=user_id,
+        limit=limit + 1,
+        before_id=cursor,
+        name_prefix=name_prefix,
+        updated_since=updated_since,
+    )
+    items: List[Dict[str, Any]] = rows[:limit]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return {"flows": items, "next_cursor": next_cursor}
+
+
+@flows_router.get("/db/flows/{flow_id}/versions")
+def list_db_flow_versions(
+    flow_id: int,
+    user_id: Optional[str] = None,
+    claims: Dict[str, Any] = Depends(require_user),
+) -> Dict[str, Any]:
+    """List the saved versions of a DB flow, newest first."""
+    user_id = resolve_user_id(claims, user_id)
+    item = db_get_flow(flow_id)
+    if not item or str(item.get("user_id")) != str(user_id):
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return {
+        "flow_id": flow_id,
+        "current_version": item.get("current_version"),
+        "versions": db_list_flow_versions(flow_id),
+    }
 
 
-@flows_router.get("/flows/{name}")
+@flows_router.get("/flows/{name}", dependencies=[Depends(get_current_user)])
 def load_flow(name: str) -> Dict[str, Any]:
     """Load a flow JSON by filename from examples.
     'name' may be provided with or without the .json extension.
@@ -119,8 +421,7 @@ def load_flow(name: str) -> Dict[str, Any]:
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="Flow not found")
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _examples_index.load(path)
         return {"name": os.path.basename(path), "workflow": data}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read flow: {e}")
@@ -132,28 +433,42 @@ def save_flow(
     req: SaveFlowRequest,
     overwrite: bool = True,
     user_id: Optional[str] = None,
+    claims: Optional[Dict[str, Any]] = Depends(get_current_user),
 ) -> Dict[str, Any]:
     """Save a flow JSON to the examples directory.
     Set overwrite=false to prevent overwriting an existing file.
+    The DB keeps one flow per (user_id, name) with a version history;
+    saving unchanged content does not create a new version. Only requests
+    with an access token are persisted to the DB, under the token subject.
     """
+    user_id = resolve_user_id(claims, user_id)
     _ensure_examples_dir()
     path = _sanitize_flow_name(name)
     if os.path.exists(path) and not overwrite:
         raise HTTPException(status_code=409, detail="Flow already exists")
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(req.workflow, f, ensure_ascii=False, indent=2)
+        _examples_index.store(path, req.workflow)
         # Also persist into SQLite DB (non-fatal if it fails)
-        db_id: Optional[int] = None
-        try:
-            init_db()
-            db_user = user_id or os.getenv("DEFAULT_USER_ID") or "default"
-            db_id = db_save_flow(
-                user_id=db_user, name=os.path.basename(path), workflow=req.workflow
-            )
-        except Exception as db_e:
-            # Log to stdout and continue without failing the request
-            print(f"[warn] DB save failed for flow '{name}': {db_e}")
-        return {"name": os.path.basename(path), "saved": True, "db_id": db_id}
+        saved: Dict[str, Any] = {}
+        if claims is None:
+            # An unauthenticated user_id could add a version to someone
+            # else's flow, which their webhooks would then run
+            print(f"[info] Flow '{name}' saved to examples only (no access token).")
+        else:
+            try:
+                init_db()
+                saved = db_save_flow(
+                    user_id=str(user_id), name=os.path.basename(path), workflow=req.workflow
+                )
+            except Exception as db_e:
+                # Log to stdout and continue without failing the request
+                print(f"[warn] DB save failed for flow '{name}': {db_e}")
+        return {
+            "name": os.path.basename(path),
+            "saved": True,
+            "db_id": saved.get("id"),
+            "version": saved.get("version"),
+            "content_hash": saved.get("content_hash"),
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to save flow: {e}")
@@ -0,0 +1,298 @@
+"""Replay captured webhook traffic against FlowArt and report latency.
+
+Examples (run from backend/):
+
+    # In-process app, open loop at 50 QPS for 30s, mocked providers
+    python -m scripts.replay --payloads captured.ndjson --flow flow_basic.json \\
+        --qps 50 --duration 30 --latency action.chat=300:100
+
+    # Local server started with PROVIDER_MOCKS="action.chat=300:100" (mocked
+    # providers), closed loop with 16 concurrent clients
+    python -m scripts.replay --payloads captured.ndjson --flow-id 42 --token "$TOKEN" \\
+        --url http://127.0.0.1:8001 --concurrency 16 --requests 2000
+
+Each NDJSON line is either a bare payload object or
+{"flow": "<examples file>", "payload": {...}, "headers": {...}}.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EXAMPLES_DIR = os.path.join(BACKEND_DIR, "examples")
+
+Sample = Tuple[Optional[str], Dict[str, Any], Dict[str, str]]
+
+
+def _load_samples(path: str, default_flow: Optional[str]) -> List[Sample]:
+    samples: List[Sample] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise SystemExit(f"{path}:{lineno}: invalid JSON ({e})")
+            if isinstance(obj, dict) and "payload" in obj:
+                samples.append(
+                    (obj.get("flow") or default_flow, obj["payload"] or {}, obj.get("headers") or {})
+                )
+            else:
+                samples.append((default_flow, obj, {}))
+    if not samples:
+        raise SystemExit(f"{path}: no payloads")
+    return samples
+
+
+def _load_flow(name: str, cache: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    if name not in cache:
+        fname = name if name.endswith(".json") else name + ".json"
+        with open(os.path.join(EXAMPLES_DIR, fname), "r", encoding="utf-8") as f:
+            cache[name] = json.load(f)
+    return cache[name]
+
+
+def _parse_latency(specs: List[str]) -> Dict[str, Tuple[float, float]]:
+    from engine.provider_mocks import parse_latency
+
+    try:
+        return parse_latency(specs)
+    except ValueError as e:
+        raise SystemExit(f"--latency: {e}")
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    s = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(s[min(len(s) - 1, int(q * len(s)))], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(s[-1], 2)}
+
+
+class _Recorder:
+    def __init__(self) -> None:
+        self.by_flow: Dict[str, List[float]] = defaultdict(list)
+        self.by_node: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Counter = Counter()
+        self.errors = 0
+        self.node_errors = 0
+        self.completed = 0
+
+    def record(self, flow: str, latency_ms: float, status: int, body: Any) -> None:
+        self.completed += 1
+        self.statuses[status] += 1
+        if status >= 400:
+            self.errors += 1
+            return
+        self.by_flow[flow].append(latency_ms)
+        for entry in (body or {}).get("logs", []) if isinstance(body, dict) else []:
+            self.by_node[str(entry.get("type"))].append(float(entry.get("elapsed_ms") or 0))
+            if entry.get("status") == "error":
+                self.node_errors += 1
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        return {
+            "requests": self.completed,
+            "wall_seconds": round(wall_seconds, 3),
+            "throughput_rps": round(self.completed / wall_seconds, 2) if wall_seconds else None,
+            "error_rate": round(self.errors / self.completed, 4) if self.completed else None,
+            "node_errors": self.node_errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "latency_ms_by_flow": {k: _percentiles(v) for k, v in sorted(self.by_flow.items())},
+            "latency_ms_by_node_type": {
+                k: _percentiles(v) for k, v in sorted(self.by_node.items())
+            },
+        }
+
+
+async def _run_hooks(hooks: List[Any], phase: str) -> None:
+    for hook in hooks:
+        try:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            # e.g. init_db without Postgres; /run-flow replays do not need it
+            print(f"[warn] {phase} hook {hook.__name__} failed: {e}", file=sys.stderr)
+
+
+@contextlib.asynccontextmanager
+async def _app_lifespan(app: Any):
+    """Run the app's startup/shutdown hooks (warming the node process pool).
+    ASGITransport sends no lifespan events, and one failing hook should not
+    stop the others, so they are called one by one.
+    """
+    await _run_hooks(app.router.on_startup, "Startup")
+    try:
+        yield
+    finally:
+        await _run_hooks(app.router.on_shutdown, "Shutdown")
+
+
+@contextlib.contextmanager
+def _silenced_stdout():
+    """Point fd 1 at /dev/null, so spawned node workers are quiet as well."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+async def _replay(args: argparse.Namespace) -> Dict[str, Any]:
+    samples = _load_samples(args.payloads, args.flow)
+    flows: Dict[str, Dict[str, Any]] = {}
+    lifespan: Any = contextlib.nullcontext()
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from engine.provider_mocks import install_mocks
+
+        install_mocks(_parse_latency(args.latency))
+        # Local tool: tolerate a missing AUTH_SECRET like a dev server would
+        os.environ.setdefault("AUTH_DEV_MODE", "true")
+        from main import app
+
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://replay", timeout=args.timeout
+        )
+        lifespan = _app_lifespan(app)
+
+    total = args.requests
+    recorder = _Recorder()
+    base_headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    def build(i: int) -> Tuple[str, str, Dict[str, Any], Dict[str, str]]:
+        flow_name, payload, headers = samples[i % len(samples)]
+        if args.flow_id is not None:
+            body_payload = dict(payload, flow_id=args.flow_id)
+            if args.user_id:
+                body_payload["user_id"] = args.user_id
+            return f"db:{args.flow_id}", "/run-flow/db", {"payload": body_payload}, headers
+        if not flow_name:
+            raise SystemExit("No flow for payload: pass --flow or a 'flow' field per line")
+        workflow = _load_flow(flow_name, flows)
+        return flow_name, "/run-flow", {"workflow": workflow, "payload": payload}, headers
+
+    async def send(i: int, scheduled: float) -> None:
+        flow_name, path, body, headers = build(i)
+        try:
+            resp = await client.post(path, json=body, headers={**base_headers, **headers})
+            status = resp.status_code
+            data = resp.json() if status < 400 else None
+        except Exception:
+            status, data = 599, None
+        # Measured from the intended send time so queueing in the driver
+        # counts against latency (no coordinated omission).
+        recorder.record(flow_name, (time.perf_counter() - scheduled) * 1000.0, status, data)
+
+    async with lifespan, client:
+        start = time.perf_counter()
+        deadline = start + args.duration if args.duration else None
+        if args.qps:
+            tasks = []
+            next_at = start
+            i = 0
+            while (total is None or i < total) and (deadline is None or next_at < deadline):
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(i, next_at)))
+                i += 1
+                gap = 1.0 / args.qps
+                next_at += random.expovariate(args.qps) if args.poisson else gap
+            await asyncio.gather(*tasks)
+        else:
+            counter = iter(range(total if total is not None else sys.maxsize))
+
+            async def worker() -> None:
+                for i in counter:
+                    if deadline is not None and time.perf_counter() >= deadline:
+                        return
+                    await send(i, time.perf_counter())
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"requests={report['requests']} wall={report['wall_seconds']}s "
+        f"throughput={report['throughput_rps']} rps error_rate={report['error_rate']} "
+        f"node_errors={report['node_errors']} statuses={report['statuses']}"
+    )
+    for title, key in (("flow", "latency_ms_by_flow"), ("node type", "latency_ms_by_node_type")):
+        print(f"\n{title:<32} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for name, p in report[key].items():
+            print(f"{name:<32} {p['p50']!s:>9} {p['p95']!s:>9} {p['p99']!s:>9} {p['max']!s:>9}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payloads", required=True, help="NDJSON file of captured webhook payloads")
+    parser.add_argument("--flow", help="examples/ flow file used for lines without a 'flow' field")
+    parser.add_argument("--flow-id", type=int, help="run a saved DB flow through /run-flow/db")
+    parser.add_argument("--user-id", help="user_id merged into payloads with --flow-id")
+    parser.add_argument("--url", help="base URL of a running server (default: in-process app)")
+    parser.add_argument("--token", help="access token sent as a Bearer Authorization header")
+    parser.add_argument("--qps", type=float, help="open-loop arrival rate; omit for closed loop")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop clients (default 8)")
+    parser.add_argument("--requests", type=int, help="total requests (default: one per payload)")
+    parser.add_argument("--duration", type=float, help="stop issuing requests after N seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout (s)")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="TYPE=MS[:JITTER]",
+        help="mocked provider latency, e.g. action.chat=300:100 (in-process; "
+        "for --url start the server with PROVIDER_MOCKS)",
+    )
+    parser.add_argument("--json", dest="json_out", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep node log output (in-process)")
+    args = parser.parse_args(argv)
+    if args.url and args.latency:
+        parser.error(
+            "--latency applies to the in-process app; start the server with "
+            'PROVIDER_MOCKS="action.chat=300:100,..." to mock providers there'
+        )
+    if args.requests is None and args.duration is None:
+        args.requests = len(_load_samples(args.payloads, args.flow))
+
+    sys.path.insert(0, BACKEND_DIR)
+    # In-process node handlers print per call; keep the report readable
+    quiet = not args.url and not args.verbose
+    with _silenced_stdout() if quiet else contextlib.nullcontext():
+        report = asyncio.run(_replay(args))
+    _print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,6 +42,7 @@ type NodeCatalogItem = {
   category: string;
   description?: string;
   ports?: string[];
+  ports_from?: string;
   config_schema?: NodeConfigSchema;
   outputs?: Record<string, any>;
   icon_url?: string;
@@ -51,14 +52,30 @@ type AuthUser = {
   id: number;
   email: string;
   role?: string;
+  access_token?: string;
 };
 
+const USER_STORAGE_KEY = "flowart_user";
+
 const VITE_API_BASE_URL = import.meta.env?.VITE_API_BASE_URL;
 console.log("VITE_API_BASE_URL", VITE_API_BASE_URL);
 const ReactFlowAny: any = ReactFlow as any;
 
+// Port names declared by a config field (e.g. logic.switch cases: value -> port)
+const portsFromConfig = (value: any): string[] => {
+  if (!value || typeof value !== "object" || Array.isArray(value)) return [];
+  return Object.values(value)
+    .filter((p: any) => typeof p === "string" && p !== "")
+    .map((p: any) => String(p));
+};
+
 const CustomNode = ({ data }: { data: any }) => {
-  const ports: string[] = (data?.ports || []).map((x: any) => String(x));
+  const ports: string[] = Array.from(
+    new Set([
+      ...(data?.ports || []).map((x: any) => String(x)),
+      ...(data?.ports_from ? portsFromConfig(data?.config?.[data.ports_from]) : []),
+    ])
+  );
   const status: string | undefined = data?.status;
   const bg =
     status === "error"
@@ -172,7 +189,7 @@ function App() {
 
   useEffect(() => {
     try {
-      const stored = window.localStorage.getItem("flow_user");
+      const stored = window.localStorage.getItem(USER_STORAGE_KEY);
       if (stored) {
         const parsed = JSON.parse(stored);
         if (
@@ -186,6 +203,26 @@ function App() {
     } catch { }
   }, []);
 
+  // Send the access token with API calls; an expired token signs the user out
+  const authFetch = useCallback(
+    async (url: string, init: RequestInit = {}) => {
+      const headers: Record<string, string> = {
+        ...((init.headers as Record<string, string>) || {}),
+      };
+      if (currentUser?.access_token) {
+        headers.Authorization = `Bearer ${currentUser.access_token}`;
+      }
+      const res = await fetch(url, { ...init, headers });
+      if (res.status === 401 && currentUser) {
+        setCurrentUser(null);
+        window.localStorage.removeItem(USER_STORAGE_KEY);
+        message.warning("Session expired, please log in again");
+      }
+      return res;
+    },
+    [currentUser]
+  );
+
   // Fetch nodes catalog
   useEffect(() => {
     const fetchCatalog = async () => {
@@ -206,9 +243,10 @@ function App() {
 
   // Fetch flows list
   const fetchFlowsList = useCallback(async () => {
+    if (!currentUser) return;
     try {
       setLoadingFlows(true);
-      const res = await fetch(`${VITE_API_BASE_URL}/flows`);
+      const res = await authFetch(`${VITE_API_BASE_URL}/flows`);
       const data = await res.json();
       setAvailableFlows(data.flows || []);
     } catch (e) {
@@ -216,7 +254,7 @@ function App() {
     } finally {
       setLoadingFlows(false);
     }
-  }, []);
+  }, [currentUser, authFetch]);
   useEffect(() => {
     fetchFlowsList();
   }, [fetchFlowsList]);
@@ -244,9 +282,10 @@ function App() {
         id: data.id,
         email: data.email,
         role: data.role,
+        access_token: data.access_token,
       };
       setCurrentUser(user);
-      window.localStorage.setItem("flowart_user", JSON.stringify(user));
+      window.localStorage.setItem(USER_STORAGE_KEY, JSON.stringify(user));
       message.success(
         authMode === "signup" ? "Signup successful" : "Login successful"
       );
@@ -259,7 +298,7 @@ function App() {
 
   const handleLogout = () => {
     setCurrentUser(null);
-    window.localStorage.removeItem("flowart_user");
+    window.localStorage.removeItem(USER_STORAGE_KEY);
   };
 
   // DnD handlers
@@ -305,6 +344,7 @@ function App() {
           type: item.type,
           label: item.label,
           ports: item.ports || [],
+          ports_from: item.ports_from,
           icon_url: item.icon_url,
           config: deriveDefaultConfig(item),
         },
@@ -402,7 +442,14 @@ function App() {
         id: n.id,
         type: "custom",
         position,
-        data: { type: n.type, label, ports, icon_url, config: n.config || {} },
+        data: {
+          type: n.type,
+          label,
+          ports,
+          ports_from: cat?.ports_from,
+          icon_url,
+          config: n.config || {},
+        },
       } as any;
     });
     const newEdges = wfEdges.map((e: any) => ({
@@ -425,7 +472,7 @@ function App() {
       return;
     }
     try {
-      const res = await fetch(
+      const res = await authFetch(
         `${VITE_API_BASE_URL}/flows/${encodeURIComponent(nm)}`
       );
       if (!res.ok) {
@@ -453,7 +500,7 @@ function App() {
       const userIdParam = currentUser?.email
         ? `&user_id=${encodeURIComponent(currentUser.id)}`
         : "";
-      const res = await fetch(
+      const res = await authFetch(
         `${VITE_API_BASE_URL}/flows/${encodeURIComponent(
           nm
         )}?overwrite=true${userIdParam}`,
@@ -482,7 +529,7 @@ function App() {
       const workflow = buildWorkflowJson();
       const initial_state = JSON.parse(initialStateText || "{}");
       const payload = JSON.parse(payloadText || "{}");
-      const res = await fetch(`${VITE_API_BASE_URL}/run-flow`, {
+      const res = await authFetch(`${VITE_API_BASE_URL}/run-flow`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ workflow, initial_state, payload }),